@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark of compression and chunking settings for time series cell files.
+
+For each setting, a cell file with synthetic soil moisture time series is
+written. Write time, file size and the latency of reading the full time
+series of single grid points are reported.
+
+Usage: python benchmarks/ts_encoding.py [--n_gpi 400] [--n_days 3650]
+'''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+from netCDF4 import Dataset
+
+from esa_cci_sm.encoding import build_encoding, write_cell_ts
+
+SETTINGS = [
+    ('default (zlib 4, shuffle)', {}),
+    ('zlib 1', {'complevel': 1}),
+    ('zlib 9', {'complevel': 9}),
+    ('no shuffle', {'shuffle': False}),
+    ('chunks (1, 4096)', {'chunksizes': (1, 4096)}),
+    ('chunks (40, 1000)', {'chunksizes': (40, 1000)}),
+    ('lsd 4', {'least_significant_digit': {'sm': 4, 'sm_uncertainty': 4}}),
+    ('lsd 3, chunks (1, 4096)', {'least_significant_digit': {'sm': 3, 'sm_uncertainty': 3},
+                                 'chunksizes': (1, 4096)}),
+]
+
+
+def synthetic_cell(n_gpi, n_days, seed=42):
+    """
+    Create soil moisture like time series for the points of a cell.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_days)
+    seasonal = 0.25 + 0.1 * np.sin(2 * np.pi * t / 365.25)
+    sm = (seasonal + rng.normal(0, 0.05, (n_gpi, n_days))).astype(np.float32)
+    sm[rng.random((n_gpi, n_days)) < 0.4] = np.nan
+    data = {'sm': sm,
+            'sm_uncertainty': np.abs(rng.normal(0.04, 0.01, (n_gpi, n_days))
+                                     ).astype(np.float32),
+            'flag': rng.choice([0, 0, 0, 1, 2, 8], (n_gpi, n_days)).astype(np.int8)}
+    data['sm_uncertainty'][np.isnan(sm)] = np.nan
+
+    gpis = np.arange(n_gpi) + 800000
+    lons = np.linspace(10, 15, n_gpi)
+    lats = np.linspace(45, 50, n_gpi)
+    timestamps = np.array([datetime(1991, 1, 1) + timedelta(days=int(d))
+                           for d in t])
+
+    return gpis, lons, lats, data, timestamps
+
+
+def run(n_gpi=400, n_days=3650, n_reads=50):
+    gpis, lons, lats, data, timestamps = synthetic_cell(n_gpi, n_days)
+    read_locs = np.random.default_rng(0).choice(n_gpi, n_reads)
+    out_dir = tempfile.mkdtemp()
+
+    print(f"{n_gpi} points, {n_days} days, {len(data)} variables\n")
+    print(f"{'setting':<28}{'write [s]':>10}{'size [MB]':>11}"
+          f"{'read [ms]':>11}{'open+read [ms]':>16}")
+    try:
+        for i, (name, settings) in enumerate(SETTINGS):
+            filename = os.path.join(out_dir, f'{i:04d}.nc')
+            encoding = build_encoding(list(data.keys()), **settings)
+
+            start = time.perf_counter()
+            write_cell_ts(filename, gpis, lons, lats, data, timestamps,
+                          encoding=encoding)
+            t_write = time.perf_counter() - start
+            size = os.path.getsize(filename) / 2**20
+
+            # read the time series of single points from the open file
+            with Dataset(filename) as ds:
+                start = time.perf_counter()
+                for loc in read_locs:
+                    for var in data.keys():
+                        ds.variables[var][loc, :]
+                t_read = (time.perf_counter() - start) / n_reads * 1000
+
+            # open the file for each time series
+            start = time.perf_counter()
+            for loc in read_locs:
+                with Dataset(filename) as ds:
+                    for var in data.keys():
+                        ds.variables[var][loc, :]
+            t_open_read = (time.perf_counter() - start) / n_reads * 1000
+
+            print(f"{name:<28}{t_write:>10.2f}{size:>11.2f}"
+                  f"{t_read:>11.2f}{t_open_read:>16.2f}")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark compression and chunking of time series files.")
+    parser.add_argument("--n_gpi", type=int, default=400,
+                        help="Number of points in the cell.")
+    parser.add_argument("--n_days", type=int, default=3650,
+                        help="Length of the time series.")
+    parser.add_argument("--n_reads", type=int, default=50,
+                        help="Number of time series to read for each setting.")
+    args = parser.parse_args(args)
+    run(args.n_gpi, args.n_days, args.n_reads)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
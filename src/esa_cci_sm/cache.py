@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Caches of open netcdf files.
+'''
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from netCDF4 import Dataset
+
+
+class DatasetPool(object):
+    """
+    Bounded LRU cache of open (read only) netCDF4 Datasets, that can be
+    shared between readers to avoid opening the same file repeatedly.
+
+    Files are opened with :meth:`open`, which keeps the file open after use.
+    When more than max_open files are open, the least recently used file
+    that is currently not in use is closed.
+    Note that netCDF4 Datasets must not be read from several threads at
+    the same time.
+
+    Parameters
+    ----------
+    max_open : int, optional (default: 32)
+        Maximum number of files that are kept open.
+
+    Attributes
+    ----------
+    hits : int
+        Number of times an open file was reused.
+    misses : int
+        Number of times a file had to be opened.
+    evictions : int
+        Number of files that were closed to make room for others.
+    """
+
+    def __init__(self, max_open=32):
+
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # filename -> [dataset, number of current users]
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, filename):
+        return filename in self._handles
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _evict(self):
+        """
+        Close least recently used files that are not in use until at most
+        max_open files are open.
+        """
+        for filename in list(self._handles.keys()):
+            if len(self._handles) <= self.max_open:
+                break
+            dataset, n_users = self._handles[filename]
+            if n_users == 0:
+                del self._handles[filename]
+                dataset.close()
+                self.evictions += 1
+
+    @contextmanager
+    def open(self, filename):
+        """
+        Get the open Dataset for a file, open it if necessary.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the netcdf file.
+
+        Yields
+        ------
+        dataset : netCDF4.Dataset
+            Open dataset, must not be closed by the caller.
+        """
+        with self._lock:
+            handle = self._handles.get(filename)
+            if handle is not None and handle[0].isopen():
+                self.hits += 1
+                self._handles.move_to_end(filename)
+            else:
+                self.misses += 1
+                handle = [Dataset(filename), 0]
+                self._handles[filename] = handle
+            handle[1] += 1
+            self._evict()
+
+        try:
+            yield handle[0]
+        finally:
+            with self._lock:
+                handle[1] -= 1
+                if self._handles.get(filename) is not handle:
+                    # closed or replaced while in use
+                    if handle[1] == 0 and handle[0].isopen():
+                        handle[0].close()
+                self._evict()
+
+    def invalidate(self, filename):
+        """
+        Close a file (e.g. when it was changed on disk), it will be opened
+        again on the next access.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the netcdf file.
+        """
+        with self._lock:
+            handle = self._handles.pop(filename, None)
+            if handle is not None and handle[1] == 0:
+                handle[0].close()
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns
+        -------
+        stats : dict
+            Number of open files, hits, misses and evictions.
+        """
+        return {'open': len(self._handles), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def close(self):
+        """
+        Close all files that are not in use and empty the pool.
+        """
+        with self._lock:
+            for filename in list(self._handles.keys()):
+                dataset, n_users = self._handles.pop(filename)
+                if n_users == 0:
+                    dataset.close()
+
+
+_shared_pool = None
+
+
+def shared_dataset_pool():
+    """
+    Get the DatasetPool that is shared by all readers that are created with
+    ``handle_pool=True``.
+
+    Returns
+    -------
+    pool : DatasetPool
+        The shared pool.
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = DatasetPool()
+    return _shared_pool
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Persistent index of the ESA CCI SM image files in a directory tree, so that
+files can be looked up by date without searching the file system.
+'''
+
+import os
+import json
+import bisect
+import warnings
+from collections import namedtuple
+from datetime import datetime
+
+from parse import parse
+
+fname_templ = '{product}-SOILMOISTURE-L3S-{data_type}-{sensor_type}-' \
+              '{datetime}000000-fv{version}.{sub_version}.nc'
+
+CatalogEntry = namedtuple('CatalogEntry',
+                          ['timestamp', 'path', 'product', 'data_type',
+                           'sensor_type', 'version', 'sub_version', 'size',
+                           'mtime'])
+
+
+class CCICatalog(object):
+    """
+    Index of all ESA CCI SM image files below a root directory.
+
+    The index is stored as a small json file. When it is refreshed, only
+    directories whose modification time changed since the last scan are
+    listed again.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the image files (e.g. with yearly sub-folders).
+    index_file : str, optional (default: None)
+        Path to the json file the index is stored in. If None is passed,
+        a file '.esa_cci_sm_catalog.json' in the root directory is used.
+    refresh : bool, optional (default: True)
+        Check the root directory for new files when loading the catalog.
+    """
+
+    version = 1
+
+    def __init__(self, root, index_file=None, refresh=True):
+
+        self.root = root
+        if index_file is None:
+            index_file = os.path.join(root, '.esa_cci_sm_catalog.json')
+        self.index_file = index_file
+
+        self._dirs = {}
+        self._by_time = {}
+        self._timestamps = []
+
+        self._load()
+
+        if refresh:
+            self.refresh()
+        else:
+            self._build_lookup()
+
+    def __len__(self):
+        return sum(len(v) for v in self._by_time.values())
+
+    def __iter__(self):
+        for timestamp in self._timestamps:
+            for entry in self._by_time[timestamp]:
+                yield entry
+
+    def _load(self):
+        """
+        Load the index from the index file, if it exists.
+        """
+        if not os.path.isfile(self.index_file):
+            return
+
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+        except (IOError, ValueError) as e:
+            warnings.warn(f"Could not load catalog {self.index_file}: {e}")
+            return
+
+        if index.get('version') == self.version:
+            self._dirs = index['dirs']
+
+    def save(self):
+        """
+        Write the index to the index file.
+        """
+        index = {'version': self.version, 'dirs': self._dirs}
+        tmp_file = self.index_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp_file, self.index_file)
+        except (IOError, OSError) as e:
+            warnings.warn(f"Could not save catalog {self.index_file}: {e}")
+
+    def _scan_dir(self, rel_path, mtime):
+        """
+        List a directory and parse the names of all CCI SM files in it.
+        """
+        subdirs, files = [], []
+        with os.scandir(os.path.join(self.root, rel_path)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    continue
+                file_args = parse(fname_templ, entry.name)
+                if file_args is None:
+                    continue
+                file_args = file_args.named
+                stat = entry.stat()
+                files.append([entry.name, file_args['datetime'],
+                              file_args['product'], file_args['data_type'],
+                              file_args['sensor_type'], file_args['version'],
+                              file_args['sub_version'], stat.st_size,
+                              stat.st_mtime])
+
+        return {'mtime': mtime, 'subdirs': sorted(subdirs),
+                'files': sorted(files)}
+
+    def refresh(self):
+        """
+        Update the index with the current content of the root directory.
+        Only directories that changed since the last scan are listed.
+
+        Returns
+        -------
+        changed : bool
+            True if the index was changed.
+        """
+        changed = False
+        dirs = {}
+        to_check = ['']
+
+        while to_check:
+            rel_path = to_check.pop()
+            try:
+                mtime = os.stat(os.path.join(self.root, rel_path)).st_mtime
+            except OSError:
+                continue
+
+            info = self._dirs.get(rel_path)
+            if (info is None) or (info['mtime'] != mtime):
+                old_info = info
+                info = self._scan_dir(rel_path, mtime)
+                # saving the index into a scanned directory changes its
+                # mtime, so only save if files were added or removed
+                if (old_info is None) or \
+                        (old_info['subdirs'] != info['subdirs']) or \
+                        (old_info['files'] != info['files']):
+                    changed = True
+
+            dirs[rel_path] = info
+            to_check.extend(os.path.join(rel_path, d) for d in info['subdirs'])
+
+        if set(dirs.keys()) != set(self._dirs.keys()):
+            changed = True
+
+        self._dirs = dirs
+        self._build_lookup()
+
+        if changed:
+            self.save()
+
+        return changed
+
+    def _build_lookup(self):
+        """
+        Build the lookup table from timestamps to files.
+        """
+        by_time = {}
+        for rel_path, info in self._dirs.items():
+            for name, date, *fields in info['files']:
+                timestamp = datetime.strptime(date, '%Y%m%d')
+                entry = CatalogEntry(timestamp,
+                                     os.path.join(self.root, rel_path, name),
+                                     *fields)
+                by_time.setdefault(timestamp, []).append(entry)
+
+        self._by_time = by_time
+        self._timestamps = sorted(by_time.keys())
+
+    def entries(self, timestamp):
+        """
+        Get the catalog entries for a timestamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        -------
+        entries : list[CatalogEntry]
+            Entries of all files for this time stamp.
+        """
+        return self._by_time.get(timestamp, [])
+
+    def filenames(self, timestamp):
+        """
+        Get the paths of the files for a timestamp.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Time stamp of the image.
+
+        Returns
+        -------
+        filenames : list[str]
+            Paths of all files for this time stamp.
+        """
+        return [e.path for e in self.entries(timestamp)]
+
+    def timestamps(self, start_date=None, end_date=None):
+        """
+        Get the time stamps of all files between start and end date.
+
+        Parameters
+        ----------
+        start_date : datetime, optional (default: None)
+            First date to include, if None is passed, start at the first file.
+        end_date : datetime, optional (default: None)
+            Last date to include, if None is passed, end at the last file.
+
+        Returns
+        -------
+        timestamps : list[datetime]
+            Sorted time stamps of available files.
+        """
+        i0 = 0 if start_date is None else \
+            bisect.bisect_left(self._timestamps, start_date)
+        i1 = len(self._timestamps) if end_date is None else \
+            bisect.bisect_right(self._timestamps, end_date)
+
+        return self._timestamps[i0:i1]
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Day of year climatologies and anomalies of reshuffled time series, computed
+for all grid points of a cell at once.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pygeogrids.netcdf import save_grid
+
+from esa_cci_sm.interface import CCITs
+from esa_cci_sm.encoding import write_cell_ts
+
+
+def doy_index(dates):
+    """
+    Get the index of the day of year of each time stamp, for a year with
+    366 days. Feb 29 is 59, the days after Feb 28 of other years are
+    shifted by one, so that the same dates get the same index in all years.
+
+    Parameters
+    ----------
+    dates : np.ndarray
+        datetime64 time stamps.
+
+    Returns
+    -------
+    index : np.ndarray
+        Day of year index (0 to 365) of each time stamp.
+    """
+    dates = pd.DatetimeIndex(dates)
+    index = dates.dayofyear.values - 1
+    index[~dates.is_leap_year & (index >= 59)] += 1
+    return index
+
+
+def climatology(data, dates, window_size=35, min_obs=5):
+    """
+    Calculate the moving window day of year climatology of several time
+    series at once. The climatology of a day is the mean of all values in
+    the window of days around it (over all years).
+
+    Parameters
+    ----------
+    data : np.ndarray
+        (n_gpi, n_time) values, missing values are NaN.
+    dates : np.ndarray
+        datetime64 time stamps of the values.
+    window_size : int, optional (default: 35)
+        Number of days in the moving window, must be odd.
+    min_obs : int, optional (default: 5)
+        Minimum number of values in the window, the climatology is NaN for
+        days with fewer values.
+
+    Returns
+    -------
+    clim : np.ndarray
+        (n_gpi, 366) climatology, see :func:`doy_index` for the days.
+    """
+    if (window_size < 1) or (window_size > 365) or (window_size % 2 == 0):
+        raise ValueError("window_size must be an odd number of days "
+                         "between 1 and 365")
+
+    data = np.asarray(data, dtype=np.float64)
+    valid = np.isfinite(data)
+    sums = np.zeros((data.shape[0], 366))
+    counts = np.zeros((data.shape[0], 366))
+
+    if data.shape[1] > 0:
+        # sum of the values of each day of year, via the sorted time steps
+        index = doy_index(dates)
+        order = np.argsort(index, kind='stable')
+        days, starts = np.unique(index[order], return_index=True)
+        sums[:, days] = np.add.reduceat(np.where(valid, data, 0.)[:, order],
+                                        starts, axis=1)
+        counts[:, days] = np.add.reduceat(valid[:, order].astype(np.float64),
+                                          starts, axis=1)
+
+    half = window_size // 2
+    window_sums = _circular_window_sum(sums, half)
+    window_counts = _circular_window_sum(counts, half)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        clim = window_sums / window_counts
+    clim[window_counts < max(min_obs, 1)] = np.nan
+
+    return clim
+
+
+def _circular_window_sum(values, half):
+    """
+    Sum of the values in the window of +-half days around each day of year,
+    the window wraps around the end of the year.
+    """
+    padded = np.concatenate([values[:, values.shape[1] - half:], values,
+                             values[:, :half]], axis=1)
+    cumsum = np.zeros((values.shape[0], padded.shape[1] + 1))
+    np.cumsum(padded, axis=1, out=cumsum[:, 1:])
+    return cumsum[:, 2 * half + 1:] - cumsum[:, :-2 * half - 1]
+
+
+def anomalies(data, dates, clim):
+    """
+    Calculate the anomalies of several time series from their climatology.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        (n_gpi, n_time) values.
+    dates : np.ndarray
+        datetime64 time stamps of the values.
+    clim : np.ndarray
+        (n_gpi, 366) climatology as returned by :func:`climatology`.
+
+    Returns
+    -------
+    anomalies : np.ndarray
+        (n_gpi, n_time) differences between the values and the climatology.
+    """
+    return np.asarray(data, dtype=np.float64) - clim[:, doy_index(dates)]
+
+
+class CCIClimatology(object):
+    """
+    Calculate the day of year climatologies and anomalies of reshuffled
+    time series and write them to a new time series dataset with the same
+    grid and cell files. The time series of each cell are read at once and
+    the climatologies of all grid points in the cell are calculated
+    together, cells can be processed in parallel processes.
+
+    For each parameter the output files contain the anomalies
+    (``<parameter>_anomaly``) and the climatology at each time stamp
+    (``<parameter>_climatology``), so that they can be read with CCITs.
+    Only the data of one cell per process is kept in memory.
+
+    Parameters
+    ----------
+    ts_path : str
+        Path of the time series to calculate the climatologies of.
+    outputpath : str
+        Path where the climatology and anomaly time series are stored.
+        Existing cell files are replaced.
+    parameters : list, optional (default: ('sm',))
+        Parameters to calculate the climatologies and anomalies of.
+    window_size : int, optional (default: 35)
+        Number of days in the moving window of the climatology, must be odd.
+    min_obs : int, optional (default: 5)
+        Minimum number of values in the window for a climatology value.
+    period : tuple, optional (default: None)
+        (start, end) datetimes of the time series to use.
+    flags_allowed : int, optional (default: None)
+        Quality filter on the flag before the calculation, see
+        :func:`esa_cci_sm.interface.quality_mask`.
+    max_uncertainty : float, optional (default: None)
+        Quality filter on the soil moisture uncertainty.
+    reader_kws : dict, optional (default: None)
+        Additional keyword arguments for the CCITs readers.
+    """
+
+    def __init__(self, ts_path, outputpath, parameters=('sm',),
+                 window_size=35, min_obs=5, period=None, flags_allowed=None,
+                 max_uncertainty=None, reader_kws=None):
+
+        self.ts_path = ts_path
+        self.outputpath = outputpath
+        self.parameters = list(parameters)
+        self.window_size = window_size
+        self.min_obs = min_obs
+        self.period = period
+        self.flags_allowed = flags_allowed
+        self.max_uncertainty = max_uncertainty
+        self.reader_kws = {} if reader_kws is None else reader_kws
+
+    def calc(self, workers=1, cells=None):
+        """
+        Calculate the climatologies and anomalies and write them.
+
+        Parameters
+        ----------
+        workers : int, optional (default: 1)
+            Number of processes that process cells in parallel.
+        cells : list, optional (default: None)
+            Cells to process. If None is passed, all cells of the time series
+            grid are processed.
+
+        Returns
+        -------
+        cells : np.ndarray
+            Cells that were written.
+        """
+        reader = CCITs(self.ts_path, **self.reader_kws)
+        grid = reader.grid
+        all_cells = np.unique(grid.activearrcell)
+        cells = all_cells if cells is None else \
+            np.intersect1d(np.atleast_1d(cells), all_cells)
+        if cells.size == 0:
+            raise ValueError("No grid points in the selected cells.")
+
+        if not os.path.exists(self.outputpath):
+            os.makedirs(self.outputpath)
+        save_grid(os.path.join(self.outputpath, 'grid.nc'),
+                  grid.subgrid_from_cells(cells))
+
+        try:
+            if workers <= 1:
+                for cell in cells:
+                    self._calc_cell(reader, cell)
+            else:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_init_reader,
+                                         initargs=(self.ts_path,
+                                                   self.reader_kws)) as pool:
+                    list(pool.map(_calc_cell, [self] * cells.size, cells))
+        finally:
+            reader.close()
+
+        return cells
+
+    def _calc_cell(self, reader, cell):
+        """
+        Read the time series of a cell and write their climatologies and
+        anomalies.
+        """
+        gpis, lons, lats = reader.grid.grid_points_for_cell(cell)
+        data, gpis, dates = reader.read_many(
+            gpis, parameters=self.parameters, period=self.period,
+            flags_allowed=self.flags_allowed,
+            max_uncertainty=self.max_uncertainty)
+
+        doy = doy_index(dates)
+        out, attributes = {}, {}
+        for parameter in self.parameters:
+            clim = climatology(data[parameter], dates, self.window_size,
+                               self.min_obs)
+            out[f'{parameter}_climatology'] = \
+                clim[:, doy].astype(np.float32)
+            out[f'{parameter}_anomaly'] = \
+                (data[parameter] - clim[:, doy]).astype(np.float32)
+            attributes[f'{parameter}_climatology'] = {
+                'long_name': f'{parameter} day of year climatology'}
+            attributes[f'{parameter}_anomaly'] = {
+                'long_name': f'{parameter} anomaly from the climatology'}
+
+        filename = os.path.join(self.outputpath, '%04d.nc' % cell)
+        if os.path.exists(filename):
+            os.remove(filename)
+        write_cell_ts(filename, gpis, lons, lats, out,
+                      dates.astype('datetime64[us]').astype(object),
+                      global_attr={'climatology_window_size': self.window_size,
+                                   'climatology_min_obs': self.min_obs},
+                      ts_attributes=attributes)
+
+
+_reader = None
+
+
+def _init_reader(ts_path, reader_kws):
+    """
+    Create the time series reader of a worker process.
+    """
+    global _reader
+    _reader = CCITs(ts_path, **reader_kws)
+
+
+def _calc_cell(engine, cell):
+    """
+    Process a cell in a worker process.
+    """
+    engine._calc_cell(_reader, cell)
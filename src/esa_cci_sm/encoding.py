@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Compression, chunking and packing of the variables in time series cell files.
+'''
+
+import numpy as np
+from pynetcf.time_series import OrthoMultiTs
+
+
+# packed values are stored as int16, the smallest value is the fill value
+_packed_dtype = np.int16
+_packed_fill_value = np.iinfo(np.int16).min
+_packed_max = np.iinfo(np.int16).max
+
+
+def packing_params(valid_min, valid_max):
+    """
+    Get the scale factor and offset to pack values in the passed range into
+    int16, with a precision of (valid_max - valid_min) / 65534.
+
+    Parameters
+    ----------
+    valid_min : float
+        Smallest value to pack.
+    valid_max : float
+        Largest value to pack.
+
+    Returns
+    -------
+    scale_factor : np.float32
+        Scale factor of the packed values.
+    add_offset : np.float32
+        Offset of the packed values.
+    """
+    scale_factor = (valid_max - valid_min) / (2. * _packed_max)
+    add_offset = (valid_max + valid_min) / 2.
+    return np.float32(scale_factor), np.float32(add_offset)
+
+
+def build_encoding(parameters, complevel=4, shuffle=True, chunksizes=None,
+                   least_significant_digit=None, packing=None):
+    """
+    Create the encoding of each time series variable.
+
+    Parameters
+    ----------
+    parameters : list
+        Names of the time series variables.
+    complevel : int, optional (default: 4)
+        zlib compression level (1-9).
+    shuffle : bool, optional (default: True)
+        Apply the HDF5 shuffle filter before compression.
+    chunksizes : tuple or dict, optional (default: None)
+        (locations, time) chunk shape of the variables, or a dict with a
+        chunk shape for each variable. The number of locations is limited
+        to the number of points in each cell. If None is passed, chunks
+        contain all locations of a cell and unlim_chunksize time stamps.
+    least_significant_digit : int or dict, optional (default: None)
+        Quantize the data to this number of decimal digits before
+        compression (lossy), or a dict with the digits for each variable.
+    packing : dict, optional (default: None)
+        Variable names as keys and (scale_factor, add_offset) as values.
+        These variables are stored as int16 values with the scale factor
+        and offset as attributes, and are unpacked by netCDF4 on reading.
+
+    Returns
+    -------
+    encoding : dict
+        Variable names as keys and dicts of encoding settings as values.
+    """
+    encoding = {}
+    for parameter in parameters:
+        encoding[parameter] = {'complevel': complevel, 'shuffle': shuffle}
+
+        var_chunks = chunksizes.get(parameter) if isinstance(chunksizes, dict) \
+            else chunksizes
+        if var_chunks is not None:
+            encoding[parameter]['chunksizes'] = tuple(var_chunks)
+
+        lsd = least_significant_digit.get(parameter) \
+            if isinstance(least_significant_digit, dict) \
+            else least_significant_digit
+        if lsd is not None:
+            encoding[parameter]['least_significant_digit'] = lsd
+
+        if (packing is not None) and (parameter in packing):
+            scale_factor, add_offset = packing[parameter]
+            encoding[parameter]['scale_factor'] = np.float32(scale_factor)
+            encoding[parameter]['add_offset'] = np.float32(add_offset)
+
+    return encoding
+
+
+def _pack_attributes(attr, scale_factor, add_offset):
+    """
+    Variable attributes for packed values. The fill value and valid range
+    are converted to packed values.
+    """
+    attr = dict(attr)
+    attr['_FillValue'] = _packed_dtype(_packed_fill_value)
+    attr['scale_factor'] = scale_factor
+    attr['add_offset'] = add_offset
+    if 'valid_range' in attr:
+        valid_range = np.round((np.asarray(attr['valid_range']) - add_offset)
+                               / scale_factor)
+        attr['valid_range'] = np.clip(valid_range, -_packed_max,
+                                      _packed_max).astype(_packed_dtype)
+    return attr
+
+
+def _mask_unpackable(data, scale_factor, add_offset):
+    """
+    Mask missing values and values that can not be packed.
+    """
+    limit = float(_packed_max) * float(scale_factor)
+    with np.errstate(invalid='ignore'):
+        invalid = ~np.isfinite(data) | (data < add_offset - limit) | \
+            (data > add_offset + limit)
+    # replace the masked values, so that packing them does not overflow
+    return np.ma.masked_array(np.where(invalid, add_offset, data),
+                              mask=invalid)
+
+
+class EncodedOrthoMultiTs(OrthoMultiTs):
+    """
+    OrthoMultiTs that creates the time series variables with the passed
+    encoding (compression level, shuffle filter, chunk shape, quantization,
+    packing).
+
+    Parameters
+    ----------
+    filename : str
+        Path to the cell file.
+    encoding : dict, optional (default: None)
+        Variable names as keys and encoding settings, see
+        :func:`build_encoding`, as values.
+    **kwargs
+        Keyword arguments that are passed to OrthoMultiTs.
+    """
+
+    def __init__(self, filename, encoding=None, **kwargs):
+        self.encoding = encoding or {}
+        super(EncodedOrthoMultiTs, self).__init__(filename, **kwargs)
+
+    def write_var(self, name, data=None, dim=None, attr={}, dtype=None,
+                  zlib=None, complevel=None, chunksizes=None, **kwargs):
+
+        encoding = self.encoding.get(name)
+        if (encoding is not None) and (name not in self.dataset.variables):
+            encoding = dict(encoding)
+            complevel = encoding.pop('complevel', complevel)
+            if 'scale_factor' in encoding:
+                attr = _pack_attributes(attr, encoding.pop('scale_factor'),
+                                        encoding.pop('add_offset'))
+                dtype = _packed_dtype
+            if 'chunksizes' in encoding:
+                n_loc, n_time = encoding.pop('chunksizes')
+                chunksizes = (min(n_loc, self.n_loc), n_time)
+            kwargs.update(encoding)
+
+        super(EncodedOrthoMultiTs, self).write_var(
+            name, data=data, dim=dim, attr=attr, dtype=dtype, zlib=zlib,
+            complevel=complevel, chunksizes=chunksizes, **kwargs)
+
+
+def write_cell_ts(filename, gpis, lons, lats, data, timestamps,
+                  global_attr=None, ts_attributes=None, zlib=True,
+                  unlim_chunksize=1000, encoding=None,
+                  time_units="days since 1858-11-17 00:00:00"):
+    """
+    Write (or append) the time series of the points of a cell to a cell file,
+    with the same attributes as repurpose's Img2Ts. Points are sorted by gpi.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the cell file.
+    gpis : np.array
+        Grid point indices of the time series.
+    lons : np.array
+        Longitudes of the grid points.
+    lats : np.array
+        Latitudes of the grid points.
+    data : dict
+        Variable names as keys and (n_gpi, n_times) arrays as values.
+    timestamps : np.array
+        Time stamps of the data.
+    global_attr : dict, optional (default: None)
+        Global attributes of the file.
+    ts_attributes : dict, optional (default: None)
+        Variable attributes.
+    zlib : bool, optional (default: True)
+        Compress the variables.
+    unlim_chunksize : int, optional (default: 1000)
+        Chunk size along the time dimension.
+    encoding : dict, optional (default: None)
+        Encoding of the variables, see :func:`build_encoding`.
+    time_units : str, optional
+        Units of the time variable.
+    """
+    idx = np.argsort(gpis)
+    gpis, lons, lats = gpis[idx], lons[idx], lats[idx]
+    data = {k: v[idx] for k, v in data.items()}
+
+    for name, var_encoding in (encoding or {}).items():
+        if (name in data) and ('scale_factor' in var_encoding):
+            data[name] = _mask_unpackable(data[name],
+                                          var_encoding['scale_factor'],
+                                          var_encoding['add_offset'])
+
+    with EncodedOrthoMultiTs(filename, encoding=encoding, n_loc=gpis.size,
+                             mode='a', zlib=zlib,
+                             unlim_chunksize=unlim_chunksize,
+                             time_units=time_units) as dataout:
+
+        if global_attr is not None:
+            for attr, value in global_attr.items():
+                dataout.add_global_attr(attr, value)
+        dataout.add_global_attr('timeSeries_format', 'OrthoMultiTs')
+        dataout.add_global_attr('geospatial_lat_min', np.min(lats))
+        dataout.add_global_attr('geospatial_lat_max', np.max(lats))
+        dataout.add_global_attr('geospatial_lon_min', np.min(lons))
+        dataout.add_global_attr('geospatial_lon_max', np.max(lons))
+
+        dataout.write_all(gpis, data, timestamps, lons=lons, lats=lats,
+                          attributes=ts_attributes)
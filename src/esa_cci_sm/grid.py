@@ -21,10 +21,109 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import numpy as np
+from netCDF4 import Dataset
+from pygeogrids.netcdf import load_grid
 from smecv_grid.grid import SMECV_Grid_v052
 
 def CCICellGrid():
     return SMECV_Grid_v052(None)
 
 def CCILandGrid():
-    return SMECV_Grid_v052('land')
\ No newline at end of file
+    return SMECV_Grid_v052('land')
+
+
+def CCIRegionGrid(land_points=True, bbox=None, cells=None, mask_file=None,
+                  mask_variable=None):
+    """
+    Subgrid of the (land) SMECV grid for a region. All passed restrictions
+    are combined.
+
+    Parameters
+    ----------
+    land_points : bool, optional (default: True)
+        Start from the land grid instead of the global grid.
+    bbox : tuple, optional (default: None)
+        (min_lon, min_lat, max_lon, max_lat) of the region.
+    cells : list, optional (default: None)
+        Numbers of the (5 DEG) cells of the region.
+    mask_file : str, optional (default: None)
+        Netcdf file that selects the points of the region, see
+        :func:`mask_file_gpis`.
+    mask_variable : str, optional (default: None)
+        Variable in the mask file to use, see :func:`mask_file_gpis`.
+
+    Returns
+    -------
+    grid : CellGrid
+        Subgrid with the points of the region.
+    """
+    grid = CCILandGrid() if land_points else CCICellGrid()
+    resolution = grid.resolution
+
+    selected = np.ones(grid.activegpis.size, dtype=bool)
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        selected &= (grid.activearrlon >= min_lon) & \
+                    (grid.activearrlon <= max_lon) & \
+                    (grid.activearrlat >= min_lat) & \
+                    (grid.activearrlat <= max_lat)
+    if cells is not None:
+        selected &= np.isin(grid.activearrcell, cells)
+    if mask_file is not None:
+        selected &= np.isin(grid.activegpis,
+                            mask_file_gpis(mask_file, mask_variable, resolution))
+
+    if not selected.any():
+        raise ValueError("There are no grid points in the selected region.")
+
+    return grid.subgrid_from_gpis(grid.activegpis[selected])
+
+
+def mask_file_gpis(mask_file, mask_variable=None, resolution=0.25):
+    """
+    Read the grid points that are selected in a mask file. This is either a
+    grid file (as written by pygeogrids, all active points are selected), or
+    a file with lat and lon coordinates and a (lat, lon) mask variable on
+    the SMECV grid, where all points with a value other than 0 are selected.
+
+    Parameters
+    ----------
+    mask_file : str
+        Path to the netcdf file.
+    mask_variable : str, optional (default: None)
+        Name of the mask variable. If None is passed, the file must contain
+        exactly one (lat, lon) variable.
+    resolution : float, optional (default: 0.25)
+        Resolution of the SMECV grid in degrees.
+
+    Returns
+    -------
+    gpis : np.ndarray
+        Grid points selected in the mask.
+    """
+    with Dataset(mask_file) as dataset:
+        is_grid_file = 'gpi' in dataset.variables
+
+        if not is_grid_file:
+            if mask_variable is None:
+                names = [name for name, var in dataset.variables.items()
+                         if var.dimensions == ('lat', 'lon')]
+                if len(names) != 1:
+                    raise ValueError(f"Found mask variables {names} in "
+                                     f"{mask_file}, select one.")
+                mask_variable = names[0]
+
+            lats = dataset.variables['lat'][:]
+            lons = dataset.variables['lon'][:]
+            mask = np.ma.filled(dataset.variables[mask_variable][:], 0) != 0
+
+    if is_grid_file:
+        return load_grid(mask_file).activegpis
+
+    rows, cols = np.nonzero(mask)
+    ncols = int(round(360. / resolution))
+    grid_rows = np.round((lats[rows] + 90.) / resolution - 0.5).astype(np.int64)
+    grid_cols = np.round((lons[cols] + 180.) / resolution - 0.5).astype(np.int64)
+
+    return np.unique(grid_rows * ncols + grid_cols)
@@ -23,7 +23,13 @@
 import warnings
 
 import numpy as np
+import pandas as pd
 import os
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
 
 from pygeobase.io_base import ImageBase, MultiTemporalImageBase
 from pygeobase.object_base import Image
@@ -31,11 +37,339 @@ from pygeobase.object_base import Image
 from pynetcf.time_series import GriddedNcOrthoMultiTs
 from pygeogrids.netcdf import load_grid
 
-from dateutil.relativedelta import relativedelta
-
 from esa_cci_sm.grid import CCICellGrid
+from esa_cci_sm.catalog import CCICatalog
+from esa_cci_sm.cache import shared_dataset_pool
+from esa_cci_sm.profiling import profiled
+from esa_cci_sm.timeaxis import decode_time
 from netCDF4 import Dataset
 
+
+class ReadPlan(object):
+    """
+    Precomputed index to extract the points of a grid from a (north-up)
+    CCI SM image array with a single gather step. Flipping, flattening and
+    sub-setting of the image are combined into one index array.
+
+    Parameters
+    ----------
+    grid : CellGrid
+        (Sub)grid of the global SMECV grid to extract data for.
+    shape : tuple
+        (n_lat, n_lon) shape of the global image in the netcdf file.
+    windowed : bool, optional (default: False)
+        Only read the bounding window of the grid points from the file.
+    array_1D : bool, optional (default: True)
+        Extract a 1D array in the order of the active grid points. Otherwise
+        a 2D (north-up) array in the shape of the grid is extracted.
+
+    Attributes
+    ----------
+    rows : slice
+        Rows (latitude) of the image to read from the file.
+    cols : slice
+        Columns (longitude) of the image to read from the file.
+    index : np.array or None
+        Index of each output element in the flattened window. None if the
+        window can be used as it is.
+    out_shape : tuple
+        Shape of the extracted array.
+    """
+
+    def __init__(self, grid, shape, windowed=False, array_1D=True):
+
+        self.grid = grid
+        self.shape = tuple(shape)
+
+        nrows, ncols = self.shape
+        gpis = grid.activegpis
+        # gpi 0 is the lower left point, the files store lats north-up
+        img_rows = nrows - 1 - gpis // ncols
+        img_cols = gpis % ncols
+
+        if windowed:
+            r0, r1 = img_rows.min(), img_rows.max() + 1
+            c0, c1 = img_cols.min(), img_cols.max() + 1
+        else:
+            r0, r1, c0, c1 = 0, nrows, 0, ncols
+
+        self.rows = slice(r0, r1)
+        self.cols = slice(c0, c1)
+
+        index = (img_rows - r0) * (c1 - c0) + (img_cols - c0)
+
+        if array_1D:
+            self.out_shape = index.shape
+        else:
+            self.out_shape = tuple(grid.shape)
+            index = np.flipud(index.reshape(self.out_shape)).flatten()
+
+        if (index.size == (r1 - r0) * (c1 - c0)) and \
+                np.array_equal(index, np.arange(index.size)):
+            index = None
+
+        self.index = index
+
+    def gather(self, data, out=None):
+        """
+        Extract the grid point values from the data read from the window.
+        Masked values are filled with NaN (float) or the fill value of the
+        variable (integer).
+
+        Parameters
+        ----------
+        data : np.ma.MaskedArray or np.ndarray
+            Data read from the file for the rows and cols of this plan.
+        out : np.ndarray, optional (default: None)
+            Array with out_shape to write the extracted values to. If None
+            is passed, a new array is created.
+
+        Returns
+        -------
+        values : np.ndarray
+            Extracted values in out_shape.
+        """
+        values = np.ma.getdata(data).reshape(-1)
+        mask = np.ma.getmask(data)
+
+        if out is None:
+            if self.index is None:
+                out = values  # data is a fresh array from netCDF4
+            else:
+                out = np.take(values, self.index, mode='clip')
+        else:
+            if self.index is None:
+                out.reshape(-1)[:] = values
+            else:
+                np.take(values, self.index, out=out.reshape(-1), mode='clip')
+
+        flat = out.reshape(-1)
+
+        if mask is not np.ma.nomask:
+            mask = mask.reshape(-1)
+            if self.index is not None:
+                mask = np.take(mask, self.index, mode='clip')
+            if mask.any():
+                if np.issubdtype(flat.dtype, np.floating):
+                    flat[mask] = np.nan
+                else:  # mask vars
+                    flat[mask] = data.fill_value
+
+        return flat.reshape(self.out_shape)
+
+
+def date_range(start_date, end_date, temporal_resolution='daily'):
+    """
+    Create all dates between start and end date (inclusive) in the given
+    temporal resolution.
+
+    Parameters
+    ----------
+    start_date : datetime
+        start of date range
+    end_date : datetime
+        end of date range
+    temporal_resolution : str, optional (default: 'daily')
+        'daily' (every day from start_date on), 'dekadal' (1st, 11th and 21st
+        of each month) or 'monthly' (1st of each month).
+
+    Returns
+    -------
+    dates : np.ndarray
+        datetime64 dates in the date range
+    """
+    start = np.datetime64(start_date, 'us')
+    end = np.datetime64(end_date, 'us')
+
+    if temporal_resolution == 'daily':
+        return np.arange(start, end + 1, np.timedelta64(1, 'D'))
+
+    months = np.arange(start.astype('datetime64[M]'),
+                       end.astype('datetime64[M]') + 1).astype('datetime64[us]')
+
+    if temporal_resolution == 'monthly':
+        dates = months
+    elif temporal_resolution == 'dekadal':
+        dekads = np.array([0, 10, 20], dtype='timedelta64[D]')
+        dates = (months[:, np.newaxis] + dekads).flatten()
+    else:
+        raise ValueError(f"Unknown temporal resolution: {temporal_resolution}")
+
+    return dates[(dates >= start) & (dates <= end)]
+
+
+_fname_datetime = re.compile(r'-(\d{14})-fv')
+
+_read_plans = OrderedDict()
+_max_read_plans = 16
+
+
+def get_read_plan(grid, shape, windowed=False, array_1D=True):
+    """
+    Get a cached read plan for the passed grid and image shape, or create
+    a new one. Plans are cached for the most recently used grids.
+
+    Parameters
+    ----------
+    grid : CellGrid
+        (Sub)grid of the global SMECV grid to extract data for.
+    shape : tuple
+        (n_lat, n_lon) shape of the global image in the netcdf file.
+    windowed : bool, optional (default: False)
+        Only read the bounding window of the grid points from the file.
+    array_1D : bool, optional (default: True)
+        Extract 1D arrays, otherwise 2D arrays in the shape of the grid.
+
+    Returns
+    -------
+    plan : ReadPlan
+        Read plan for the grid and shape.
+    """
+    # the plan keeps a reference to the grid, so its id is not reused
+    key = (id(grid), tuple(shape), windowed, array_1D)
+
+    try:
+        plan = _read_plans[key]
+        _read_plans.move_to_end(key)
+    except KeyError:
+        plan = ReadPlan(grid, shape, windowed=windowed, array_1D=array_1D)
+        _read_plans[key] = plan
+        if len(_read_plans) > _max_read_plans:
+            _read_plans.popitem(last=False)
+
+    return plan
+
+
+def image_coords(grid, array_1D=False):
+    """
+    Get the coordinates of the images that are read for a grid.
+
+    Parameters
+    ----------
+    grid : CellGrid
+        (Sub)grid that is read.
+    array_1D : bool, optional (default: False)
+        Coordinates for 1D images, otherwise for 2D (north-up) images in the
+        shape of the grid.
+
+    Returns
+    -------
+    lon : np.array
+        Longitudes of the image pixels.
+    lat : np.array
+        Latitudes of the image pixels.
+    """
+    if array_1D:
+        return grid.activearrlon, grid.activearrlat
+    else:
+        yres, xres = grid.shape
+        return grid.activearrlon.reshape((yres, xres)), \
+            np.flipud(grid.activearrlat.reshape((yres, xres)))
+
+
+# parameters that are masked by the quality filter
+_filtered_parameters = ('sm', 'sm_uncertainty')
+
+
+def quality_mask(data, flags_allowed=None, max_uncertainty=None):
+    """
+    Find the observations that pass a quality filter on the flag and the
+    soil moisture uncertainty.
+
+    Parameters
+    ----------
+    data : dict
+        Parameter names as keys and arrays as values, must contain 'flag'
+        and/or 'sm_uncertainty' for the used filters.
+    flags_allowed : int, optional (default: None)
+        Bits of the flag that are allowed, observations with other bits set
+        (or without flag) do not pass. E.g. 0 for unflagged observations only.
+        If None is passed, the flag is not checked.
+    max_uncertainty : float, optional (default: None)
+        Observations with a larger (or missing) uncertainty do not pass.
+        If None is passed, the uncertainty is not checked.
+
+    Returns
+    -------
+    good : np.ndarray or bool
+        True for the observations that pass the filter.
+    """
+    good = True
+    if flags_allowed is not None:
+        flag = data['flag']
+        good = good & ~np.ma.getmaskarray(flag) & \
+            ((np.ma.getdata(flag).astype(np.int64) & ~int(flags_allowed)) == 0)
+    if max_uncertainty is not None:
+        uncertainty = np.ma.filled(
+            np.ma.asarray(data['sm_uncertainty'], dtype=np.float64), np.nan)
+        good = good & (uncertainty <= max_uncertainty)
+    return good
+
+
+def _quality_parameters(flags_allowed=None, max_uncertainty=None,
+                        drop_masked=False):
+    """
+    Get the parameters that have to be read for a quality filter.
+    """
+    parameters = []
+    if flags_allowed is not None:
+        parameters.append('flag')
+    if max_uncertainty is not None:
+        parameters.append('sm_uncertainty')
+    if drop_masked:
+        parameters.append('sm')
+    return parameters
+
+
+def _filter_quality(data, flags_allowed=None, max_uncertainty=None):
+    """
+    Mask the soil moisture and its uncertainty in the data (dict of arrays)
+    where the quality filter is not passed. Masked arrays are masked, other
+    arrays are set to NaN.
+    """
+    if (flags_allowed is None) and (max_uncertainty is None):
+        return
+
+    try:
+        bad = ~quality_mask(data, flags_allowed, max_uncertainty)
+    except KeyError as e:
+        raise ValueError(f"{e} is needed for the quality filter but was not "
+                         f"found")
+
+    for parameter in _filtered_parameters:
+        if parameter not in data:
+            continue
+        value = data[parameter]
+        if isinstance(value, np.ma.MaskedArray):
+            data[parameter] = np.ma.masked_where(bad, value)
+        else:
+            if value.dtype.kind != 'f':
+                value = value.astype(np.float64)
+            value[bad] = np.nan
+            data[parameter] = value
+
+
+_prefetch_reader = None
+_map_reader = None
+
+
+def _init_prefetch_reader(data_path, reader_kws):
+    """
+    Create the image reader of a prefetch worker process.
+    """
+    global _prefetch_reader
+    _prefetch_reader = CCI_SM_025Ds(data_path, **reader_kws)
+
+
+def _prefetch_image(timestamp):
+    """
+    Read an image in a prefetch worker process. Only the data and metadata
+    are returned, the coordinates are added by the main process.
+    """
+    img = _prefetch_reader.read(timestamp)
+    return img.data, img.metadata
+
+
 class CCI_SM_025Img(ImageBase):
     """
     Class for reading one ESA CCI SM netcdf image file on a 0.25 DEG grid.
@@ -49,21 +383,71 @@ class CCI_SM_025Img(ImageBase):
     parameter : str or list[str,...], optional (default: 'sm')
         One or list of parameters to read, see ESA CCI documentation for
         more information
+    subgrid : CellGrid, optional (default: None)
+        Subgrid of the global SMECV grid to read data for. If None is passed,
+        all points of the global grid are read.
     array_1D: boolean, optional (default: False)
         If set then the data is read into 1D arrays. Where the first element
         refers to the lower left data point in the 2d image.
+    windowed: boolean, optional (default: False)
+        If set then only the bounding box (rows/columns) of the points in the
+        subgrid is read from the netcdf file instead of the whole global
+        image. This makes reading small regional subgrids much faster.
+    handle_pool: DatasetPool, optional (default: None)
+        Pool of open netcdf files to take the file from. The file is then
+        not closed after reading. If None is passed, the file is opened and
+        closed for each read.
+    profiler: Profiler, optional (default: None)
+        Profiler to time opening ('open'), reading and decompressing ('read')
+        and masking/indexing ('gather') with, and to count the images and
+        bytes read.
     """
 
     def __init__(self, filename, mode='r', parameter=None, subgrid=None,
-                 array_1D=False):
+                 array_1D=False, windowed=False, handle_pool=None,
+                 profiler=None):
 
         super(CCI_SM_025Img, self).__init__(filename, mode=mode)
 
         self.parameters = [parameter] if isinstance(parameter, str) else parameter
         self.grid = CCICellGrid() if not subgrid else subgrid
         self.array_1D = array_1D
+        self.windowed = windowed
+        self.handle_pool = handle_pool
+        self.profiler = profiler
+
+    @contextmanager
+    def _dataset(self):
+        """
+        Open the netcdf file, or take it from the handle pool.
+        """
+        try:
+            with profiled(self.profiler, 'open'):
+                if self.handle_pool is None:
+                    dataset = Dataset(self.filename)
+                else:
+                    handle = self.handle_pool.open(self.filename)
+                    dataset = handle.__enter__()
+        except IOError as e:
+            raise IOError(f"Could not open file {self.filename}: {e}")
+
+        try:
+            yield dataset
+        finally:
+            if self.handle_pool is None:
+                dataset.close()
+            else:
+                handle.__exit__(None, None, None)
 
-    def read(self, timestamp=None):
+    def _read_plan(self, shape):
+        """
+        Get the (cached) read plan for the grid of this reader and an image
+        of the passed shape.
+        """
+        return get_read_plan(self.grid, shape, windowed=self.windowed,
+                             array_1D=self.array_1D)
+
+    def read(self, timestamp=None, flags_allowed=None, max_uncertainty=None):
         """
         Read data from loaded netcdf file.
 
@@ -71,6 +455,13 @@ class CCI_SM_025Img(ImageBase):
         ----------
         timestamp: datetime
             Time stamp for this image.
+        flags_allowed : int, optional (default: None)
+            Set soil moisture and its uncertainty to NaN where other bits
+            of the flag than these are set, e.g. 0 to keep only unflagged
+            observations. See :func:`quality_mask`.
+        max_uncertainty : float, optional (default: None)
+            Set soil moisture and its uncertainty to NaN where the
+            uncertainty is larger than this.
 
         Returns
         -------
@@ -80,60 +471,90 @@ class CCI_SM_025Img(ImageBase):
         return_img = {}
         return_metadata = {}
 
-        try:
-            dataset = Dataset(self.filename)
-        except IOError as e:
-            raise IOError(f"Could not open file {self.filename}: {e}")
+        with self._dataset() as dataset:
+            if self.parameters is None:
+                param_names = [p for p in dataset.variables.keys()
+                               if p not in ['time', 'lat', 'lon']]
+                extra_names = []
+            else:
+                extra_names = [p for p in _quality_parameters(
+                    flags_allowed, max_uncertainty) if p not in self.parameters]
+                param_names = self.parameters + extra_names
 
-        if self.parameters is None:
-            param_names = [p for p in dataset.variables.keys() if p not in ['time', 'lat', 'lon']]
-        else:
-            param_names = self.parameters
-
-        for parameter, variable in dataset.variables.items():
-            if parameter in param_names:
-                param_metadata = {}
-                for attrname in variable.ncattrs():
-                    param_metadata.update(
-                        {str(attrname): getattr(variable, attrname)})
-
-                param_data = dataset.variables[parameter][:]
-                param_data = np.flipud(param_data[0,:,:]).flatten()
-                if np.ma.is_masked(param_data):
+            for parameter, variable in dataset.variables.items():
+                if parameter in param_names:
+                    param_metadata = {}
+                    for attrname in variable.ncattrs():
+                        param_metadata.update(
+                            {str(attrname): getattr(variable, attrname)})
+
+                    plan = self._read_plan(variable.shape[1:])
+                    with profiled(self.profiler, 'read'):
+                        param_data = variable[0, plan.rows, plan.cols]
+                    with profiled(self.profiler, 'gather'):
+                        return_img.update({str(parameter): plan.gather(param_data)})
+                    self._count_read(param_data)
+                    return_metadata.update({str(parameter): param_metadata})
+
+                    # Check for corrupt files
                     try:
-                        param_data = np.ma.masked_array(param_data).filled(np.nan)
-                    except TypeError: # mask vars
-                        param_data = np.ma.masked_array(param_data).filled()
+                        return_img[parameter]
+                    except KeyError:
+                        path, thefile = os.path.split(self.filename)
+                        warnings.warn(f"{parameter} in {thefile} is corrupt - "
+                                      f"filling image with NaN values")
+                        return_img[parameter] = np.empty(self.grid.n_gpi).fill(np.nan)
+
+        if self.profiler is not None:
+            self.profiler.count('images')
+
+        with profiled(self.profiler, 'gather'):
+            _filter_quality(return_img, flags_allowed, max_uncertainty)
+        for parameter in extra_names:
+            return_img.pop(parameter, None)
+            return_metadata.pop(parameter, None)
 
-                return_img.update(
-                    {str(parameter): param_data[self.grid.activegpis]})
-                return_metadata.update({str(parameter): param_metadata})
+        lon, lat = image_coords(self.grid, self.array_1D)
 
-                # Check for corrupt files
+        return Image(lon, lat, return_img, return_metadata, timestamp)
+
+    def read_into(self, out, index):
+        """
+        Read the data of this file directly into preallocated arrays,
+        without creating an intermediate Image.
+
+        Parameters
+        ----------
+        out : dict
+            Parameter names as keys and arrays as values. The data of each
+            parameter is written to ``out[parameter][index]``, which must
+            have the shape of the grid (1D or 2D, depending on array_1D).
+        index : int
+            Index along the first axis of the arrays in out to write to.
+        """
+        with self._dataset() as dataset:
+            for parameter, buffer in out.items():
                 try:
-                    return_img[parameter]
+                    variable = dataset.variables[parameter]
                 except KeyError:
-                    path, thefile = os.path.split(self.filename)
-                    warnings.warn(f"{parameter} in {thefile} is corrupt - "
-                                  f"filling image with NaN values")
-                    return_img[parameter] = np.empty(self.grid.n_gpi).fill(np.nan)
+                    raise IOError(f"{parameter} not found in {self.filename}")
 
-        dataset.close()
+                plan = self._read_plan(variable.shape[1:])
+                with profiled(self.profiler, 'read'):
+                    param_data = variable[0, plan.rows, plan.cols]
+                with profiled(self.profiler, 'gather'):
+                    plan.gather(param_data, out=buffer[index])
+                self._count_read(param_data)
 
-        if self.array_1D:
-            return Image(self.grid.activearrlon, self.grid.activearrlat,
-                         return_img, return_metadata, timestamp)
-        else:
-            yres, xres = self.grid.shape
-            for key in return_img:
-                return_img[key] = return_img[key].reshape((yres, xres))
+        if self.profiler is not None:
+            self.profiler.count('images')
 
-            return Image(
-                self.grid.activearrlon.reshape((yres, xres)),
-                np.flipud(self.grid.activearrlat.reshape((yres, xres))),
-                {k: np.flipud(v) for k, v in return_img.items()},
-                return_metadata,
-                timestamp)
+    def _count_read(self, data):
+        """
+        Count the (uncompressed) bytes of the data read from the file.
+        """
+        if self.profiler is not None:
+            self.profiler.count('bytes_read', data.nbytes)
 
     def write(self, data):
         raise NotImplementedError()
@@ -155,15 +576,68 @@ class CCI_SM_025Ds(MultiTemporalImageBase):
     parameter : string or list, optional (default: 'sm')
         One or list of parameters to read, see ESA CCI SM documentation
         for more information
+    subgrid : CellGrid, optional (default: None)
+        Subgrid of the global SMECV grid to read data for. If None is passed,
+        all points of the global grid are read.
     array_1D: boolean, optional (default: False)
         If set then the data is read into 1D arrays. Needed for some legacy code.
+    windowed: boolean, optional (default: False)
+        Only read the bounding window of the subgrid from each image file,
+        see :class:`CCI_SM_025Img`.
+    catalog: CCICatalog or bool, optional (default: None)
+        Catalog of the files in data_path, that is used to find the files
+        for a date instead of searching the file system. If True is passed,
+        a catalog is created (or loaded) with the default index file in
+        data_path. When a catalog is used, only dates with available files
+        are returned by tstamps_for_daterange.
+    temporal_resolution: str, optional (default: 'daily')
+        Temporal resolution of the images: 'daily', 'dekadal' (images on the
+        1st, 11th and 21st of each month) or 'monthly' (images on the 1st of
+        each month).
+    only_available: bool, optional (default: False)
+        Only return dates for which a file exists in tstamps_for_daterange.
+        All directories in data_path are listed once to find the files.
+    handle_pool: DatasetPool or bool, optional (default: None)
+        Keep image files open in this pool of netcdf handles, so that
+        repeated reads of the same files do not open them again. If True is
+        passed, a pool that is shared by all datasets is used.
+    profiler: Profiler, optional (default: None)
+        Profiler to time searching files ('search') and reading the images
+        with, see :class:`esa_cci_sm.profiling.Profiler`.
     """
 
-    def __init__(self, data_path, parameter=None, subgrid=None, array_1D=False):
+    def __init__(self, data_path, parameter=None, subgrid=None, array_1D=False,
+                 windowed=False, catalog=None, temporal_resolution='daily',
+                 only_available=False, handle_pool=None, profiler=None):
+
+        if temporal_resolution not in ['daily', 'dekadal', 'monthly']:
+            raise ValueError(f"Unknown temporal resolution: {temporal_resolution}")
+
+        self.temporal_resolution = temporal_resolution
+        self.only_available = only_available
+        self._available = None
+
+        # create the grid only once, it is shared by all image readers
+        self.grid = CCICellGrid() if not subgrid else subgrid
+        self._stack_buffers = {}
+
+        if catalog is True:
+            catalog = CCICatalog(data_path)
+        self.catalog = catalog or None
+
+        if handle_pool is True:
+            handle_pool = shared_dataset_pool()
+        elif handle_pool is False:
+            handle_pool = None
+        self.handle_pool = handle_pool
+        self.profiler = profiler
 
         ioclass_kws = {'parameter': parameter,
-                       'subgrid': subgrid,
-                       'array_1D': array_1D}
+                       'subgrid': self.grid,
+                       'array_1D': array_1D,
+                       'windowed': windowed,
+                       'handle_pool': self.handle_pool,
+                       'profiler': self.profiler}
 
         sub_path = ['%Y']
         filename_templ = "ESACCI-SOILMOISTURE-L3S-*-{datetime}-fv*.nc"
@@ -174,9 +648,34 @@ class CCI_SM_025Ds(MultiTemporalImageBase):
                                                   exact_templ=False,
                                                   ioclass_kws=ioclass_kws)
 
-    def tstamps_for_daterange(self, start_date, end_date):
+    def _available_timestamps(self):
+        """
+        Find the time stamps of all image files in the data path. Each
+        (yearly) sub-folder is listed only once.
+
+        Returns
+        -------
+        timestamps : np.ndarray
+            Sorted datetime64 time stamps of all available files.
+        """
+        if self.catalog is not None:
+            return np.array(self.catalog.timestamps(), dtype='datetime64[us]')
+
+        dates = []
+        for curr, subdirs, files in os.walk(self.path):
+            for f in files:
+                match = _fname_datetime.search(f)
+                if match is not None:
+                    dates.append(match.group(1))
+
+        dates = np.unique(dates)
+        return np.array([datetime.strptime(d, self.datetime_format)
+                         for d in dates], dtype='datetime64[us]')
+
+    def tstamps_for_daterange(self, start_date, end_date, only_available=None):
         """
-        Return timestamps for the passed date range,
+        Return timestamps for the passed date range, in the temporal
+        resolution of the dataset.
 
         Parameters
         ----------
@@ -184,6 +683,10 @@ class CCI_SM_025Ds(MultiTemporalImageBase):
             start of date range
         end_date: datetime
             end of date range
+        only_available: bool, optional (default: None)
+            Only return dates for which a file exists. If None is passed,
+            the setting from the dataset initialisation is used. This is
+            always done when a catalog is used.
 
         Returns
         -------
@@ -191,17 +694,249 @@ class CCI_SM_025Ds(MultiTemporalImageBase):
             list of datetime objects of each available image between
             start_date and end_date
         """
+        if only_available is None:
+            only_available = self.only_available
+
+        timestamps = date_range(start_date, end_date, self.temporal_resolution)
 
-        next = lambda date: date + relativedelta(days=1)
+        if only_available or (self.catalog is not None):
+            if self._available is None or self.catalog is not None:
+                with profiled(self.profiler, 'search'):
+                    self._available = self._available_timestamps()
+            timestamps = timestamps[np.isin(timestamps, self._available)]
 
-        timestamps = [start_date]
-        while next(timestamps[-1]) <= end_date:
-            timestamps.append(next(timestamps[-1]))
+        return timestamps.astype(datetime).tolist()
+
+    def _search_files(self, timestamp, custom_templ=None, str_param=None,
+                      custom_datetime_format=None):
+        """
+        Search the files for a timestamp, in the catalog if one is used.
+        """
+        with profiled(self.profiler, 'search'):
+            if self.catalog is not None and custom_templ is None and \
+                    str_param is None and custom_datetime_format is None:
+                return self.catalog.filenames(timestamp)
 
-        return timestamps
+            return super(CCI_SM_025Ds, self)._search_files(
+                timestamp, custom_templ=custom_templ, str_param=str_param,
+                custom_datetime_format=custom_datetime_format)
+
+    def stack_layout(self, filename):
+        """
+        Get the data type and shape of the images of each parameter, as read
+        by :meth:`read_stack`.
+
+        Parameters
+        ----------
+        filename : str
+            Image file to take the parameters, dtypes and shape from.
+
+        Returns
+        -------
+        layout : dict
+            Parameter names as keys and (dtype, image shape) as values.
+        """
+        parameters = self.ioclass_kws['parameter']
+        if isinstance(parameters, str):
+            parameters = [parameters]
+
+        layout = {}
+        with Dataset(filename) as dataset:
+            if parameters is None:
+                parameters = [p for p in dataset.variables.keys()
+                              if p not in ['time', 'lat', 'lon']]
+
+            for parameter in parameters:
+                variable = dataset.variables[parameter]
+                plan = get_read_plan(self.grid, variable.shape[1:],
+                                     windowed=self.ioclass_kws['windowed'],
+                                     array_1D=self.ioclass_kws['array_1D'])
+                layout[parameter] = (variable.dtype, plan.out_shape)
+
+        return layout
+
+    def _get_stack_buffers(self, filename, n):
+        """
+        Get arrays to read a stack of n images into. Arrays from previous
+        calls are reused if they are large enough.
+
+        Parameters
+        ----------
+        filename : str
+            Image file to take the parameters, dtypes and shape from.
+        n : int
+            Number of images in the stack.
+
+        Returns
+        -------
+        buffers : dict
+            Parameter names as keys and (at least) n images as values.
+        """
+        buffers = {}
+        for parameter, (dtype, shape) in self.stack_layout(filename).items():
+            buffer = self._stack_buffers.get(parameter)
+            if (buffer is None) or (buffer.shape[0] < n) or \
+                    (buffer.shape[1:] != shape) or (buffer.dtype != dtype):
+                buffer = np.empty((n,) + shape, dtype=dtype)
+                self._stack_buffers[parameter] = buffer
+
+            buffers[parameter] = buffer
+
+        return buffers
+
+    def release_stack_buffers(self):
+        """
+        Drop the arrays that stacks of images are read into, new (e.g.
+        smaller) arrays are allocated by the next stack read.
+        """
+        self._stack_buffers = {}
+
+    def reader_kws(self):
+        """
+        Keyword arguments to create a copy of this dataset, e.g. in another
+        process (without the handle pool and profiler).
+
+        Returns
+        -------
+        kws : dict
+            Keyword arguments for CCI_SM_025Ds, besides the data path.
+        """
+        return {'parameter': self.ioclass_kws['parameter'],
+                'subgrid': self.grid,
+                'array_1D': self.ioclass_kws['array_1D'],
+                'windowed': self.ioclass_kws['windowed'],
+                'catalog': self.catalog,
+                'temporal_resolution': self.temporal_resolution,
+                'only_available': self.only_available}
+
+    def read_stack(self, timestamps, out=None):
+        """
+        Read the images for the passed timestamps directly into one
+        (n_times, n_gpis) array per parameter, without creating intermediate
+        arrays for each image. Missing or corrupt images are skipped.
+
+        Parameters
+        ----------
+        timestamps : list[datetime]
+            Time stamps of the images to read, e.g. from
+            :meth:`tstamps_for_daterange`.
+        out : dict, optional (default: None)
+            Parameter names as keys and arrays to read the stack into as
+            values. Each array must have at least len(timestamps) elements
+            along the first axis. If None is passed, arrays are taken from an
+            internal pool which is reused (and overwritten) by the next call.
+
+        Returns
+        -------
+        data : dict
+            Parameter names as keys and arrays of the images that were read
+            as values (views of the arrays in out).
+        timestamps : list[datetime]
+            Time stamps of the images that were read.
+        """
+        filenames, read_timestamps = [], []
+        for timestamp in timestamps:
+            try:
+                filenames.append(self._build_filename(timestamp))
+            except IOError as e:
+                warnings.warn(str(e))
+                continue
+            read_timestamps.append(timestamp)
+
+        if len(filenames) == 0:
+            return {}, []
+
+        if out is None:
+            out = self._get_stack_buffers(filenames[0], len(filenames))
+
+        i, timestamps = 0, []
+        for filename, timestamp in zip(filenames, read_timestamps):
+            img = self.ioclass(filename, mode=self.mode, **self.ioclass_kws)
+            try:
+                img.read_into(out, i)
+            except IOError as e:
+                warnings.warn(f"Could not read image at {timestamp}: {e}")
+                continue
+            timestamps.append(timestamp)
+            i += 1
+
+        return {k: v[:i] for k, v in out.items()}, timestamps
+
+    def iter_images(self, start_date, end_date, prefetch=0, workers=1,
+                    **kwargs):
+        """
+        Yield all images for a given date range. Upcoming images can be read
+        in background processes while the current image is processed.
+
+        Parameters
+        ----------
+        start_date : datetime
+            start date
+        end_date : datetime
+            end date
+        prefetch : int, optional (default: 0)
+            Number of images that are read ahead of the image that is
+            currently processed. At most this number of images (plus the
+            current one) is kept in memory. If 0 is passed, images are read
+            one after the other when they are requested.
+        workers : int, optional (default: 1)
+            Number of processes that read images in parallel when prefetching.
+            Processes are used instead of threads, as netcdf files can not be
+            read from multiple threads safely. The time spent waiting for
+            prefetched images is profiled as stage 'wait'.
+
+        Yields
+        ------
+        image : Image
+            pygeobase.object_base.Image object, in the order of the dates.
+        """
+        if prefetch < 1 or kwargs:
+            for img in super(CCI_SM_025Ds, self).iter_images(
+                    start_date, end_date, **kwargs):
+                yield img
+            return
+
+        timestamps = self.tstamps_for_daterange(start_date, end_date)
+        if not timestamps:
+            raise IOError("no files found for given date range")
+
+        reader_kws = self.reader_kws()
+        lon, lat = image_coords(self.grid, self.ioclass_kws['array_1D'])
+
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, prefetch)),
+                                 initializer=_init_prefetch_reader,
+                                 initargs=(self.path, reader_kws)) as pool:
+            pending = deque()
+            timestamps = iter(timestamps)
+            try:
+                for timestamp in timestamps:
+                    pending.append((timestamp,
+                                    pool.submit(_prefetch_image, timestamp)))
+                    if len(pending) <= prefetch:
+                        continue
+                    timestamp, future = pending.popleft()
+                    yield self._prefetched_image(lon, lat, timestamp, future)
+
+                while pending:
+                    timestamp, future = pending.popleft()
+                    yield self._prefetched_image(lon, lat, timestamp, future)
+            finally:
+                for timestamp, future in pending:
+                    future.cancel()
+
+    def _prefetched_image(self, lon, lat, timestamp, future):
+        """
+        Wait for an image that is read in a background process.
+        """
+        with profiled(self.profiler, 'wait'):
+            data, metadata = future.result()
+        if self.profiler is not None:
+            self.profiler.count('images')
+        return Image(lon, lat, data, metadata, timestamp)
 
 class CCITs(GriddedNcOrthoMultiTs):
-    def __init__(self, ts_path, grid_path=None, **kwargs):
+    def __init__(self, ts_path, grid_path=None, profiler=None,
+                 max_open_files=1, max_cached_bytes=None, **kwargs):
         '''
         Class for reading ESA CCI SM time series after reshuffling.
 
@@ -213,6 +948,34 @@ class CCITs(GriddedNcOrthoMultiTs):
             Path to grid file, that is used to organize the location of time
             series to read. If None is passed, grid.nc is searched for in the
             ts_path.
+        profiler : Profiler, optional (default: None)
+            Profiler to time opening cell files ('open') and reading time
+            series ('read', including opening) with, and to count the time
+            series read.
+        max_open_files : int, optional (default: 1)
+            Number of cell files that are kept open. When more files are
+            opened, the least recently used one is closed. Keeping several
+            files open is faster when reads jump between cells.
+        max_cached_bytes : int, optional (default: None)
+            Maximum size of the data that is kept in memory for the open
+            files with read_bulk. Least recently used files are closed when a
+            file is opened and the data of the open files exceeds this size.
+
+        Cache statistics are available via :meth:`cache_stats`.
+
+        The time series of a location are read with ``read(gpi)`` or
+        ``read(lon, lat)``. Pass ``start`` and/or ``end`` (datetime) to only
+        read this period (inclusive) from the file, instead of reading the
+        whole time series and selecting the period afterwards (``period``).
+        If ``period`` is passed as well, only the dates in both are read.
+        With ``flags_allowed`` and/or ``max_uncertainty`` soil moisture and
+        its uncertainty are masked by the flag and the uncertainty (see
+        :func:`quality_mask`) before the DataFrame is created,
+        ``drop_masked=True`` drops the time stamps without valid soil
+        moisture.
+        The time stamps of each cell file are converted to datetime64 with
+        array operations (instead of netCDF4.num2date) and shared by all cell
+        files with the same time axis.
 
         Optional keyword arguments that are passed to the Gridded Base:
         ------------------------------------------------------------------------
@@ -237,5 +1000,602 @@ class CCITs(GriddedNcOrthoMultiTs):
         if grid_path is None:
             grid_path = os.path.join(ts_path, "grid.nc")
 
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+
+        self.profiler = profiler
+        # keep the raw time values as index, see _read_gp
+        self._dates_direct = False
+        self.max_open_files = max_open_files
+        self.max_cached_bytes = max_cached_bytes
+        # to create a copy of the reader in another process
+        self._reader_kws = dict(kwargs, grid_path=grid_path)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # cell -> open OrthoMultiTs, in the order of the last use
+        self._open_files = OrderedDict()
         grid = load_grid(grid_path)
         super(CCITs, self).__init__(ts_path, grid, **kwargs)
+
+    def _open(self, gp):
+        with profiled(self.profiler, 'open'):
+            if self.mode != 'r':
+                return super(CCITs, self)._open(gp)
+
+            cell = self.grid.gpi2cell(gp)
+            fid = self._open_files.get(cell)
+            if fid is not None:
+                self.hits += 1
+                self._open_files.move_to_end(cell)
+            else:
+                self.misses += 1
+                filename = os.path.join(self.path,
+                                        f"{self.fn_format.format(cell)}.nc")
+                try:
+                    fid = self.ioclass(filename, mode=self.mode,
+                                       **self.ioclass_kws)
+                except (IOError, RuntimeError):
+                    warnings.warn(f"I/O error {filename}", RuntimeWarning)
+                    return False
+                # decoded once per file with decode_time instead of num2date
+                fid.dates = _decode_cell_dates(fid)
+                self._open_files[cell] = fid
+
+            self.fid = fid
+            self.previous_cell = cell
+            # the base reader reads the raw time values if dates is None
+            self.dates = None if self._dates_direct else fid.dates
+            self._evict()
+
+            return True
+
+    def _cached_bytes(self):
+        """
+        Size of the data that the open files keep in memory (read_bulk).
+        """
+        return sum(value.nbytes for fid in self._open_files.values()
+                   if fid.read_bulk for value in fid.variables.values())
+
+    def _evict(self):
+        """
+        Close least recently used files (except the current one) until the
+        number of open files and the cached data are within the limits.
+        """
+        for cell in list(self._open_files.keys()):
+            if (len(self._open_files) <= self.max_open_files) and \
+                    ((self.max_cached_bytes is None) or
+                     (self._cached_bytes() <= self.max_cached_bytes)):
+                break
+            fid = self._open_files[cell]
+            if fid is self.fid:
+                continue
+            del self._open_files[cell]
+            fid.close()
+            self.evictions += 1
+
+    def cache_stats(self):
+        """
+        Get the statistics of the open cell files.
+
+        Returns
+        -------
+        stats : dict
+            Number of open files, hits, misses, evictions and the size of
+            the data cached in memory (bytes).
+        """
+        return {'open': len(self._open_files), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'cached_bytes': self._cached_bytes()}
+
+    def close(self):
+        """
+        Close all open cell files.
+        """
+        if self.mode != 'r':
+            return super(CCITs, self).close()
+
+        for fid in self._open_files.values():
+            fid.close()
+        self._open_files.clear()
+        self.fid = None
+
+    def _read_gp(self, gpi, start=None, end=None, flags_allowed=None,
+                 max_uncertainty=None, drop_masked=False, **kwargs):
+        windowed = (start is not None) or (end is not None) or \
+            (flags_allowed is not None) or (max_uncertainty is not None) or \
+            drop_masked
+        if windowed:
+            start, end = _intersect_period(start, end,
+                                           kwargs.pop('period', None))
+            if kwargs:
+                raise ValueError(f"{', '.join(kwargs)} can not be combined "
+                                 f"with start, end or the quality filter.")
+        with profiled(self.profiler, 'read'):
+            if not windowed:
+                self._dates_direct = kwargs.get('dates_direct', False)
+                try:
+                    ts = super(CCITs, self)._read_gp(gpi, **kwargs)
+                finally:
+                    self._dates_direct = False
+            else:
+                ts = self._read_gp_window(gpi, start, end, flags_allowed,
+                                          max_uncertainty, drop_masked)
+        if self.profiler is not None:
+            self.profiler.count('time_series')
+        return ts
+
+    def _read_gp_window(self, gpi, start, end, flags_allowed=None,
+                        max_uncertainty=None, drop_masked=False):
+        """
+        Read the time series of a grid point between start and end date,
+        only the time steps in this period are read from the file. The
+        quality filter is applied to the arrays before the DataFrame is
+        created.
+        """
+        if not self._open(gpi):
+            return None
+        fid = self.fid
+
+        dates = self._cell_dates()
+        window = _time_window(dates, start, end)
+        row = fid._get_loc_id_index(gpi)
+
+        parameters = self.parameters
+        if parameters is None:
+            parameters = fid._get_all_ts_variables()
+        extra = [p for p in _quality_parameters(
+            flags_allowed, max_uncertainty, drop_masked) if p not in parameters]
+
+        data = {p: np.ma.asarray(_read_window(fid, p, row, window))
+                for p in list(parameters) + extra}
+        _filter_quality(data, flags_allowed, max_uncertainty)
+        dates = dates[window]
+
+        if drop_masked:
+            keep = ~np.ma.getmaskarray(data['sm']) & \
+                ~np.isnan(np.ma.getdata(data['sm']))
+            data = {p: v[keep] for p, v in data.items()}
+            dates = dates[keep]
+        for parameter in extra:
+            data.pop(parameter)
+
+        ts = pd.DataFrame(data, index=dates)
+
+        if self.dtypes is not None:
+            for column, dtype in self.dtypes.items():
+                if column in ts.columns:
+                    ts[column] = ts[column].astype(dtype)
+        if self.scale_factors is not None:
+            for column, scale_factor in self.scale_factors.items():
+                if column in ts.columns:
+                    ts[column] *= scale_factor
+        if self.offsets is not None:
+            for column, offset in self.offsets.items():
+                if column in ts.columns:
+                    ts[column] += offset
+
+        return ts
+
+    def _cell_dates(self):
+        """
+        Get the decoded time stamps of the open cell file, they are decoded
+        when the file is opened.
+        """
+        return self.fid.dates
+
+    def read_many(self, gpis=None, lon=None, lat=None, parameters=None,
+                  period=None, as_xarray=False, flags_allowed=None,
+                  max_uncertainty=None, drop_masked=False):
+        """
+        Read the time series of many locations at once. The locations are
+        grouped by cell, each cell file is opened once and the time series
+        of all requested locations in it are read with one read per
+        variable. No DataFrame is created for the single locations.
+
+        Parameters
+        ----------
+        gpis : int or list or np.ndarray, optional (default: None)
+            Grid points to read.
+        lon : float or np.ndarray, optional (default: None)
+            Longitudes of the locations to read the nearest grid points of,
+            if no gpis are passed.
+        lat : float or np.ndarray, optional (default: None)
+            Latitudes of the locations to read the nearest grid points of,
+            if no gpis are passed.
+        parameters : str or list, optional (default: None)
+            Parameters to read. If None is passed, the parameters selected
+            when creating the reader are read, or all if none were selected.
+        period : tuple, optional (default: None)
+            (start, end) datetimes of the time series to read (inclusive).
+        as_xarray : bool, optional (default: False)
+            Return an xarray.Dataset with (location, time) variables and the
+            gpi, lon and lat of each location as coordinates (needs xarray).
+        flags_allowed : int, optional (default: None)
+            Mask soil moisture and its uncertainty where other bits of the
+            flag than these are set, e.g. 0 to keep only unflagged
+            observations. See :func:`quality_mask`.
+        max_uncertainty : float, optional (default: None)
+            Mask soil moisture and its uncertainty where the uncertainty is
+            larger than this.
+        drop_masked : bool, optional (default: False)
+            Drop the time stamps without valid soil moisture at all locations.
+
+        Returns
+        -------
+        data : dict
+            Parameter names as keys and (n_gpi, n_time) arrays as values,
+            in the order of the requested locations. Missing values are NaN
+            (float parameters) or the fill value (integer parameters).
+        gpis : np.ndarray
+            Grid points of the locations.
+        dates : np.ndarray
+            datetime64 time stamps of the time series.
+        """
+        if gpis is None:
+            if (lon is None) or (lat is None):
+                raise ValueError("Pass either gpis or lon and lat.")
+            gpis, _ = self.grid.find_nearest_gpi(np.atleast_1d(lon),
+                                                 np.atleast_1d(lat))
+
+        gpis = np.atleast_1d(np.asarray(gpis, dtype=np.int64))
+        if gpis.size == 0:
+            raise ValueError("No locations passed.")
+        unknown = gpis[~np.isin(gpis, self.grid.activegpis)]
+        if unknown.size > 0:
+            raise ValueError(f"Grid points {unknown.tolist()} are not in the "
+                             f"grid of the time series.")
+
+        if parameters is None:
+            parameters = self.parameters
+        elif isinstance(parameters, str):
+            parameters = [parameters]
+
+        extra = []
+        if parameters is not None:
+            extra = [p for p in _quality_parameters(
+                flags_allowed, max_uncertainty, drop_masked)
+                if p not in parameters]
+            parameters = list(parameters) + extra
+
+        cells = self.grid.gpi2cell(gpis)
+        chunks = []
+        with profiled(self.profiler, 'read'):
+            for cell in np.unique(cells):
+                pos = np.flatnonzero(cells == cell)
+                values, dates = self._read_cell_locations(
+                    gpis[pos], parameters, period, flags_allowed,
+                    max_uncertainty)
+                chunks.append((pos, values, dates))
+        if self.profiler is not None:
+            self.profiler.count('time_series', gpis.size)
+
+        # the cells of a dataset normally have the same time stamps
+        dates = chunks[0][2]
+        if not all(np.array_equal(dates, c[2]) for c in chunks[1:]):
+            dates = np.unique(np.concatenate([c[2] for c in chunks]))
+
+        data = {}
+        for pos, values, cell_dates in chunks:
+            time_pos = np.searchsorted(dates, cell_dates)
+            for parameter, value in values.items():
+                if parameter not in data:
+                    data[parameter] = np.ma.masked_all(
+                        (gpis.size, dates.size), dtype=value.dtype)
+                    data[parameter].fill_value = value.fill_value
+                data[parameter][np.ix_(pos, time_pos)] = value
+
+        for parameter, value in data.items():
+            if value.dtype.kind == 'f':
+                data[parameter] = np.ma.filled(value, np.nan)
+            else:
+                data[parameter] = np.ma.filled(value)
+
+        if drop_masked:
+            keep = ~np.all(np.isnan(data['sm']), axis=0)
+            data = {p: v[:, keep] for p, v in data.items()}
+            dates = dates[keep]
+        for parameter in extra:
+            data.pop(parameter)
+
+        if not as_xarray:
+            return data, gpis, dates
+
+        try:
+            import xarray as xr
+        except ImportError:
+            raise ImportError("xarray is needed to read into an xarray Dataset, "
+                              "install it with: pip install esa_cci_sm[xarray]")
+
+        lons, lats = self.grid.gpi2lonlat(gpis)
+        return xr.Dataset(
+            {p: (('location', 'time'), v) for p, v in data.items()},
+            coords={'gpi': ('location', gpis), 'lon': ('location', lons),
+                    'lat': ('location', lats), 'time': dates})
+
+    def map_cells(self, func, workers=1, cells=None, parameters=None,
+                  period=None, outfile=None):
+        """
+        Apply a function to the time series of all locations, one cell at a
+        time. The time series of all locations in a cell are read at once
+        and passed to the function together, so that it can compute its
+        results for all of them with array operations. Cells can be
+        processed in parallel processes, each process opens its own files.
+
+        Parameters
+        ----------
+        func : callable
+            Called with the time series of the locations in a cell as
+            ``func(data, dates)``, with data and dates as returned by
+            :meth:`read_many`. Must return a dict of arrays with one element
+            (or row) per location, e.g. ``{'mean': np.nanmean(data['sm'], 1)}``.
+            For several workers the function must be defined at module level,
+            so that it can be passed to the worker processes.
+        workers : int, optional (default: 1)
+            Number of processes that process cells in parallel.
+        cells : list, optional (default: None)
+            Cells to process. If None is passed, all cells of the grid are
+            processed.
+        parameters : list, optional (default: None)
+            Parameters to read, see :meth:`read_many`.
+        period : tuple, optional (default: None)
+            (start, end) datetimes of the time series to read.
+        outfile : str, optional (default: None)
+            Netcdf file that the results are written to, as soon as a cell
+            is done. It contains the gpi, lon and lat of each location and
+            one variable per result.
+
+        Returns
+        -------
+        results : dict
+            Result names as keys and arrays with the results of all locations
+            as values.
+        gpis : np.ndarray
+            Grid points of the locations, sorted by cell and gpi.
+        """
+        gpis, gpi_cells = self.grid.activegpis, self.grid.activearrcell
+        selected = np.ones(gpis.size, dtype=bool) if cells is None else \
+            np.isin(gpi_cells, cells)
+        order = np.lexsort((gpis[selected], gpi_cells[selected]))
+        gpis, gpi_cells = gpis[selected][order], gpi_cells[selected][order]
+        if gpis.size == 0:
+            raise ValueError("No grid points in the selected cells.")
+
+        _, starts = np.unique(gpi_cells, return_index=True)
+        ends = np.append(starts[1:], gpis.size)
+
+        results = {}
+        dataset = None
+        if outfile is not None:
+            lons, lats = self.grid.gpi2lonlat(gpis)
+            dataset = _create_map_file(outfile, gpis, lons, lats)
+
+        def collect(start, cell_results):
+            for name, value in cell_results.items():
+                if name not in results:
+                    results[name] = np.empty((gpis.size,) + value.shape[1:],
+                                             dtype=value.dtype)
+                    if dataset is not None:
+                        _create_map_variable(dataset, name, value)
+                results[name][start:start + len(value)] = value
+                if dataset is not None:
+                    dataset.variables[name][start:start + len(value)] = value
+
+        try:
+            if workers <= 1:
+                for start, end in zip(starts, ends):
+                    collect(start, _apply_to_cell(self, gpis[start:end], func,
+                                                  parameters, period))
+            else:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_init_map_reader,
+                                         initargs=(self.path,
+                                                   self._reader_kws)) as pool:
+                    futures = {pool.submit(_map_cell, gpis[start:end], func,
+                                           parameters, period): start
+                               for start, end in zip(starts, ends)}
+                    for future in as_completed(futures):
+                        collect(futures[future], future.result())
+        finally:
+            if dataset is not None:
+                dataset.close()
+
+        return results, gpis
+
+    def _read_cell_locations(self, gpis, parameters, period=None,
+                             flags_allowed=None, max_uncertainty=None):
+        """
+        Read the time series of several grid points of the same cell and
+        apply the quality filter.
+
+        Returns
+        -------
+        values : dict
+            Parameter names as keys and (n_gpi, n_time) masked arrays as
+            values.
+        dates : np.ndarray
+            datetime64 time stamps of the cell file in the period.
+        """
+        if not self._open(gpis[0]):
+            raise IOError(f"Could not open the time series file of grid "
+                          f"point {gpis[0]}")
+        fid = self.fid
+
+        if parameters is None:
+            parameters = fid._get_all_ts_variables()
+
+        rows = np.atleast_1d(fid._get_loc_id_index(gpis))
+        dates = self._cell_dates()
+
+        window = slice(None)
+        if period is not None:
+            window = _time_window(dates, period[0], period[1])
+        dates = dates[window]
+
+        values = {}
+        for parameter in parameters:
+            value = np.ma.asarray(_read_window(fid, parameter, rows, window))
+
+            if (self.scale_factors is not None) and (parameter in self.scale_factors):
+                value = value * self.scale_factors[parameter]
+            if (self.offsets is not None) and (parameter in self.offsets):
+                value = value + self.offsets[parameter]
+
+            values[parameter] = value
+
+        _filter_quality(values, flags_allowed, max_uncertainty)
+
+        return values, dates
+
+
+def _decode_cell_dates(fid):
+    """
+    Decode the time stamps of an OrthoMultiTs cell file. Files with the same
+    time axis share the decoded time stamps (see
+    :func:`esa_cci_sm.timeaxis.decode_time`).
+    """
+    time = fid.dataset.variables[fid.time_var]
+    return decode_time(time[:], time.units,
+                       getattr(time, 'calendar', 'standard'))
+
+
+def _intersect_period(start, end, period=None):
+    """
+    Combine the start and end date of a read with a (start, end) period,
+    only the time stamps in both are read.
+
+    Returns
+    -------
+    start : pd.Timestamp or None
+        Later of the two start dates.
+    end : pd.Timestamp or None
+        Earlier of the two end dates.
+    """
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if period is None:
+        return start, end
+
+    period_start, period_end = period
+    if period_start is not None:
+        period_start = pd.Timestamp(period_start)
+        start = period_start if start is None else max(start, period_start)
+    if period_end is not None:
+        period_end = pd.Timestamp(period_end)
+        end = period_end if end is None else min(end, period_end)
+
+    if (start is not None) and (end is not None) and (start > end):
+        raise ValueError("The period does not overlap with start and end.")
+
+    return start, end
+
+
+def _time_window(dates, start=None, end=None):
+    """
+    Find the time steps between start and end (inclusive) in sorted dates.
+
+    Parameters
+    ----------
+    dates : np.ndarray
+        Sorted datetime64 time stamps.
+    start : datetime, optional (default: None)
+        First date of the window, None for the first time stamp.
+    end : datetime, optional (default: None)
+        Last date of the window, None for the last time stamp.
+
+    Returns
+    -------
+    window : slice
+        Indices of the time steps in the window.
+    """
+    t0 = 0 if start is None else \
+        np.searchsorted(dates, np.datetime64(start), 'left')
+    t1 = dates.size if end is None else \
+        np.searchsorted(dates, np.datetime64(end), 'right')
+    return slice(t0, max(t0, t1))
+
+
+def _read_window(fid, parameter, rows, window):
+    """
+    Read the time steps in window of one or more locations (rows) of a
+    parameter from an OrthoMultiTs file. For several rows, all rows
+    between the first and the last one are read at once.
+    """
+    if fid.read_bulk:
+        if parameter not in fid.variables:
+            fid.variables[parameter] = fid.dataset.variables[parameter][:]
+        return fid.variables[parameter][rows, window]
+
+    variable = fid.dataset.variables[parameter]
+    if np.ndim(rows) == 0:
+        return variable[rows, window]
+
+    r0, r1 = rows.min(), rows.max() + 1
+    return variable[r0:r1, window][rows - r0]
+
+
+def _apply_to_cell(reader, gpis, func, parameters, period):
+    """
+    Read the time series of the grid points of a cell and apply the map
+    function to them.
+    """
+    data, _, dates = reader.read_many(gpis, parameters=parameters,
+                                      period=period)
+    cell_results = func(data, dates)
+    if not isinstance(cell_results, dict):
+        raise ValueError("The map function must return a dict of arrays.")
+
+    cell_results = {k: np.asarray(v) for k, v in cell_results.items()}
+    for name, value in cell_results.items():
+        if (value.ndim == 0) or (len(value) != len(gpis)):
+            raise ValueError(f"Result {name} must have one value per location.")
+
+    return cell_results
+
+
+def _init_map_reader(ts_path, reader_kws):
+    """
+    Create the time series reader of a map_cells worker process.
+    """
+    global _map_reader
+    _map_reader = CCITs(ts_path, **reader_kws)
+
+
+def _map_cell(gpis, func, parameters, period):
+    """
+    Apply the map function to the grid points of a cell, in a worker process.
+    """
+    return _apply_to_cell(_map_reader, gpis, func, parameters, period)
+
+
+def _create_map_file(filename, gpis, lons, lats):
+    """
+    Create the netcdf file for the results of map_cells.
+    """
+    dataset = Dataset(filename, 'w')
+    dataset.createDimension('locations', gpis.size)
+    for name, values, attrs in [
+            ('gpi', gpis, {'long_name': 'grid point index'}),
+            ('lon', lons, {'standard_name': 'longitude',
+                           'units': 'degrees_east'}),
+            ('lat', lats, {'standard_name': 'latitude',
+                           'units': 'degrees_north'})]:
+        variable = dataset.createVariable(name, np.asarray(values).dtype,
+                                          ('locations',))
+        variable.setncatts(attrs)
+        variable[:] = values
+    return dataset
+
+
+def _create_map_variable(dataset, name, value):
+    """
+    Create the variable for a result of map_cells, with additional
+    dimensions for results with more than one value per location.
+    """
+    dims = ['locations']
+    for i, size in enumerate(value.shape[1:]):
+        dim = f'{name}_dim{i}'
+        dataset.createDimension(dim, size)
+        dims.append(dim)
+    dtype = np.int8 if value.dtype == bool else value.dtype
+    dataset.createVariable(name, dtype, tuple(dims), zlib=True)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Timing, throughput and memory instrumentation of reading and reshuffling.
+'''
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def current_rss():
+    """
+    Get the current memory use (resident set size) of the process.
+
+    Returns
+    -------
+    rss : int or None
+        Memory use in bytes, None if it can not be determined.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Get the peak memory use (resident set size) of the process.
+
+    Returns
+    -------
+    rss : int or None
+        Memory use in bytes, None if it can not be determined.
+    """
+    try:
+        import resource
+    except ImportError:  # not available on windows
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Profiler(object):
+    """
+    Collects the time spent in named stages (e.g. 'search', 'open', 'read',
+    'gather', 'write'), counters (e.g. number of images and bytes read) and
+    the peak memory use. Readers and reshuffle engines that are given a
+    profiler time their stages with it.
+
+    Parameters
+    ----------
+    report_interval : float, optional (default: None)
+        Print a short summary at most every this many seconds, when a stage
+        ends. If None is passed, nothing is printed.
+    label : str, optional (default: None)
+        Prefix of the printed summaries, e.g. to tell workers apart.
+
+    Attributes
+    ----------
+    stages : dict
+        Stage names as keys and [seconds, calls] as values.
+    counters : dict
+        Counter names as keys and their values.
+    """
+
+    def __init__(self, report_interval=None, label=None):
+        self.report_interval = report_interval
+        self.label = label
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code in the with block as (part of) a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage. Time of nested stages is counted in the outer
+            stage as well.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            t1 = time.perf_counter()
+            stage = self.stages.setdefault(name, [0., 0])
+            stage[0] += t1 - t0
+            stage[1] += 1
+            if (self.report_interval is not None) and \
+                    (t1 - self._last_report >= self.report_interval):
+                self._last_report = t1
+                self.print_summary()
+
+    def count(self, name, n=1):
+        """
+        Increase a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter, e.g. 'images' or 'bytes_read'.
+        n : int or float, optional (default: 1)
+            Value to add to the counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def update_memory(self):
+        """
+        Update the peak memory use with the peak of this process.
+        """
+        peak = peak_rss()
+        if peak is not None:
+            self.peak_memory = max(self.peak_memory, peak)
+
+    def merge(self, report):
+        """
+        Add the stages and counters of a report from another profiler, e.g.
+        of a worker process.
+
+        Parameters
+        ----------
+        report : dict
+            Report as returned by :meth:`report`.
+        """
+        for name, stage in report['stages'].items():
+            own = self.stages.setdefault(name, [0., 0])
+            own[0] += stage['seconds']
+            own[1] += stage['calls']
+        for name, value in report['counters'].items():
+            self.count(name, value)
+        self.peak_memory = max(self.peak_memory, report['peak_memory'])
+
+    def report(self):
+        """
+        Get the collected statistics.
+
+        Returns
+        -------
+        report : dict
+            Elapsed wall time (seconds), stages (seconds, calls and share of
+            the wall time), counters, throughput (counter values per second of
+            wall time) and peak memory (bytes). Time of stages that ran in
+            other processes can exceed the wall time.
+        """
+        self.update_memory()
+        wall_time = time.perf_counter() - self._start
+
+        stages = {}
+        for name, (seconds, calls) in self.stages.items():
+            stages[name] = {'seconds': seconds, 'calls': calls,
+                            'share': seconds / wall_time if wall_time else 0.}
+
+        throughput = {name: value / wall_time if wall_time else 0.
+                      for name, value in self.counters.items()}
+
+        return {'wall_time': wall_time, 'stages': stages,
+                'counters': dict(self.counters), 'throughput': throughput,
+                'peak_memory': self.peak_memory}
+
+    def summary(self):
+        """
+        Get a one line summary of the statistics.
+
+        Returns
+        -------
+        summary : str
+            Wall time, time per stage, counters and peak memory.
+        """
+        report = self.report()
+        parts = [f"{report['wall_time']:.1f}s"]
+        parts += [f"{name} {stage['seconds']:.1f}s"
+                  for name, stage in sorted(report['stages'].items())]
+        parts += [f"{name} {value:,}"
+                  for name, value in sorted(report['counters'].items())]
+        parts.append(f"peak memory {report['peak_memory'] / 2**20:.0f} MB")
+        prefix = '' if self.label is None else f"{self.label}: "
+        return prefix + ', '.join(parts)
+
+    def print_summary(self):
+        """
+        Print the one line summary.
+        """
+        print(self.summary())
+
+    def save(self, filename):
+        """
+        Write the report to a json file.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the json file.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+def profiled(profiler, name):
+    """
+    Time a stage with the profiler, if one is passed.
+
+    Parameters
+    ----------
+    profiler : Profiler or None
+        Profiler to time the stage with.
+    name : str
+        Name of the stage.
+
+    Returns
+    -------
+    context : context manager
+        Stage of the profiler or a context manager that does nothing.
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
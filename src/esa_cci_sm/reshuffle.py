@@ -28,29 +28,420 @@ time series format using the repurpose package
 
 import os
 import sys
+import json
+import queue
+import traceback
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import shutil
+import warnings
+import tempfile
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from parse import parse
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from repurpose.img2ts import Img2Ts
+from pygeogrids.netcdf import save_grid, load_grid
 from esa_cci_sm.interface import CCI_SM_025Ds
-from esa_cci_sm.grid import CCILandGrid, CCICellGrid
+from esa_cci_sm.catalog import CCICatalog, fname_templ
+from esa_cci_sm.staging import StagingImg2Ts
+from esa_cci_sm.encoding import build_encoding, write_cell_ts, packing_params
+from esa_cci_sm.grid import CCIRegionGrid
+from esa_cci_sm.profiling import Profiler, profiled, current_rss, peak_rss
 
 import configparser
 
 from collections import OrderedDict
 
-from netCDF4 import Dataset
+from netCDF4 import Dataset, num2date, date2num
 import numpy as np
 
 
+class CCIImg2Ts(Img2Ts):
+    """
+    Img2Ts for CCI SM image stacks. Images are read with
+    :meth:`esa_cci_sm.interface.CCI_SM_025Ds.read_stack` directly into one
+    preallocated array per parameter that is reused for each image buffer,
+    instead of collecting and stacking the single images.
+    The input dataset must be on the input/target grid (no resampling).
+
+    Parameters
+    ----------
+    checkpoint : callable, optional (default: None)
+        Called with the last time stamp of each image buffer, after the
+        buffer was written to all cell files.
+    memory_limit : int, optional (default: None)
+        Memory (in bytes) that the process should not exceed. If the peak
+        memory use after writing an image buffer is above this limit, the
+        number of images in the following buffers is reduced.
+    encoding : dict, optional (default: None)
+        Compression and chunking of the time series variables, see
+        :func:`esa_cci_sm.encoding.build_encoding`.
+    pipelined : bool, optional (default: False)
+        Read the next image buffer in a separate process while the current
+        one is written. The two buffers are kept in shared memory.
+    profiler : Profiler, optional (default: None)
+        Profiler to time writing the cell files ('write') with. Reading is
+        profiled by the profiler of the input dataset, when pipelined the
+        statistics of the reading process are added at the end and the time
+        spent waiting for it is profiled as 'wait'.
+    **kwargs
+        Keyword arguments that are passed to Img2Ts.
+    """
+
+    def __init__(self, *args, checkpoint=None, memory_limit=None,
+                 encoding=None, pipelined=False, profiler=None, **kwargs):
+        super(CCIImg2Ts, self).__init__(*args, **kwargs)
+        self.checkpoint = checkpoint
+        self.memory_limit = memory_limit
+        self.encoding = encoding
+        self.pipelined = pipelined
+        self.profiler = profiler
+        self._last_peak = 0
+
+    def _write_orthogonal(self, cell, cell_gpis, cell_lons, cell_lats,
+                          timestamps, **celldata):
+        """
+        Append the time series chunk of a cell to its file, with the
+        encoding of the variables.
+        """
+        with profiled(self.profiler, 'write'):
+            write_cell_ts(os.path.join(self.outputpath, self.filename_templ % cell),
+                          cell_gpis, cell_lons, cell_lats, celldata, timestamps,
+                          global_attr=self.global_attr,
+                          ts_attributes=self.ts_attributes, zlib=self.zlib,
+                          unlim_chunksize=self.unlim_chunksize,
+                          encoding=self.encoding, time_units=self.time_units)
+        if self.profiler is not None:
+            self.profiler.count('bytes_written',
+                                sum(v.nbytes for v in celldata.values()))
+
+    def _adapt_imgbuffer(self):
+        """
+        Reduce the image buffer size if the peak memory use of the process
+        exceeded the memory limit.
+        """
+        # the peak memory use only changes when a buffer used more memory
+        # than all buffers before
+        peak, last_peak = peak_rss(), self._last_peak
+        self._last_peak = peak
+        if (peak is None) or (peak <= self.memory_limit) or \
+                (peak <= last_peak) or (self.imgbuffer == 1):
+            return
+
+        imgbuffer = max(1, int(self.imgbuffer * 0.9 * self.memory_limit / peak))
+        warnings.warn(f"Memory use of {peak / 2**20:.0f} MB exceeds the limit, "
+                      f"reducing imgbuffer from {self.imgbuffer} to {imgbuffer}")
+        self.imgbuffer = imgbuffer
+        # drop the large stack buffers, smaller ones are allocated next time
+        self.imgin.release_stack_buffers()
+
+    def img_bulk(self):
+        """
+        Yields stacks of images from imgbuffer between start and enddate
+        until all images have been read.
+
+        Yields
+        ------
+        img_stack_dict : dict[str, np.ndarray]
+            stack of daily images for each variable
+        timestamps : np.ndarray
+            array of the timestamps of each image
+        """
+        timestamps = self.imgin.tstamps_for_daterange(
+            self.startdate, self.enddate)
+
+        if self.pipelined:
+            for img_dict, dates in self._img_bulk_pipelined(timestamps):
+                yield img_dict, dates
+            return
+
+        i = 0
+        while i < len(timestamps):
+            # the buffer size can change between buffers
+            dates = timestamps[i:i + self.imgbuffer]
+            i += len(dates)
+            img_dict, dates = self.imgin.read_stack(dates)
+
+            if len(dates) > 0:
+                # all observations in a CCI image have the same timestamp
+                self.orthogonal = True
+
+            yield img_dict, np.array(dates)
+
+            self._buffer_written(dates)
+
+    def _buffer_written(self, dates):
+        """
+        Called after an image buffer was written to the cell files.
+        """
+        if (self.checkpoint is not None) and (len(dates) > 0):
+            self.checkpoint(dates[-1])
+        if self.profiler is not None:
+            self.profiler.update_memory()
+        if self.memory_limit is not None:
+            self._adapt_imgbuffer()
+
+    def _img_bulk_pipelined(self, timestamps):
+        """
+        Yield image buffers that are read by a producer process into two
+        alternating shared memory buffers. A buffer is handed back to the
+        producer when it was written.
+        """
+        layout = None
+        for timestamp in timestamps:
+            try:
+                layout = self.imgin.stack_layout(
+                    self.imgin._build_filename(timestamp))
+                break
+            except IOError:
+                continue
+        if layout is None:
+            return
+
+        capacity = self.imgbuffer
+        slots = []
+        for _ in range(2):
+            slots.append({p: SharedMemory(create=True, size=max(1,
+                          capacity * int(np.prod(shape)) * np.dtype(dtype).itemsize))
+                          for p, (dtype, shape) in layout.items()})
+
+        ctx = multiprocessing.get_context()
+        free_slots, ready = ctx.Queue(), ctx.Queue()
+        producer = ctx.Process(
+            target=_produce_stacks,
+            args=(self.imgin.path, self.imgin.reader_kws(), timestamps,
+                  layout, capacity,
+                  [{p: shm.name for p, shm in slot.items()} for slot in slots],
+                  free_slots, ready, self.profiler is not None))
+        producer.start()
+
+        try:
+            for slot in range(len(slots)):
+                free_slots.put((slot, self.imgbuffer))
+
+            while True:
+                try:
+                    with profiled(self.profiler, 'wait'):
+                        item = ready.get(timeout=1)
+                except queue.Empty:
+                    if not producer.is_alive():
+                        raise RuntimeError("The image reading process stopped "
+                                           "unexpectedly.")
+                    continue
+
+                if isinstance(item, dict):
+                    # statistics of the reading process, sent at the end
+                    if self.profiler is not None:
+                        self.profiler.merge(item)
+                    break
+                if isinstance(item, str):
+                    raise RuntimeError(f"Reading images failed:\n{item}")
+
+                slot, n, dates = item
+                img_dict = {p: _shared_stack(slots[slot][p], layout[p],
+                                             capacity)[:n]
+                            for p in layout.keys()}
+                if n > 0:
+                    # all observations in a CCI image have the same timestamp
+                    self.orthogonal = True
+
+                yield img_dict, np.array(dates)
+                del img_dict
+
+                self._buffer_written(dates)
+                free_slots.put((slot, self.imgbuffer))
+        finally:
+            free_slots.put((None, 0))
+            producer.join(timeout=10)
+            if producer.is_alive():
+                producer.terminate()
+            for slot in slots:
+                for shm in slot.values():
+                    try:
+                        shm.close()
+                    except BufferError:  # still referenced after an error
+                        pass
+                    shm.unlink()
+
+
+def _shared_stack(shm, layout, capacity):
+    """
+    Array of capacity images in a shared memory block.
+    """
+    dtype, shape = layout
+    return np.ndarray((capacity,) + tuple(shape), dtype=dtype, buffer=shm.buf)
+
+
+def _produce_stacks(data_path, reader_kws, timestamps, layout, capacity,
+                    slot_names, free_slots, ready, profile=False):
+    """
+    Read image buffers into shared memory, in a separate process. Waits for
+    (slot, number of images) from free_slots and puts (slot, number of images
+    read, time stamps) into ready. The profiler report of the process (empty
+    if profile is False) is put into ready at the end, or the traceback if
+    reading failed.
+    """
+    slots = []
+    try:
+        profiler = Profiler() if profile else None
+        reader = CCI_SM_025Ds(data_path, profiler=profiler, **reader_kws)
+        slots = [{p: SharedMemory(name=name) for p, name in names.items()}
+                 for names in slot_names]
+
+        i = 0
+        while i < len(timestamps):
+            slot, n = free_slots.get()
+            if slot is None:
+                return
+            dates = timestamps[i:i + min(n, capacity)]
+            i += len(dates)
+
+            out = {p: _shared_stack(slots[slot][p], layout[p], capacity)
+                   for p in layout.keys()}
+            _, dates = reader.read_stack(dates, out=out)
+            del out, _
+            ready.put((slot, len(dates), dates))
+
+        ready.put({} if profiler is None else profiler.report())
+    except Exception:
+        ready.put(traceback.format_exc())
+    finally:
+        for slot in slots:
+            for shm in slot.values():
+                shm.close()
+
+
+def parse_size(size):
+    """
+    Convert a memory size like '16GB', '500M' or '1e9' to bytes.
+
+    Parameters
+    ----------
+    size : str or int
+        Size in bytes, or with a unit (K, M, G, T).
+
+    Returns
+    -------
+    size : int
+        Size in bytes.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = size.strip().upper().rstrip('B').rstrip('I')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def estimate_imgbuffer(input_dataset, timestamps, memory_limit, n_buffers=1):
+    """
+    Estimate the largest number of images that can be converted at once
+    without exceeding the memory limit. The size of an image is taken from
+    the variables of the first file and the grid of the input dataset.
+
+    Parameters
+    ----------
+    input_dataset : CCI_SM_025Ds
+        Dataset the images are read from.
+    timestamps : list[datetime]
+        Time stamps of the images that are converted.
+    memory_limit : int
+        Memory (in bytes) that the process should not exceed.
+    n_buffers : int, optional (default: 1)
+        Number of image buffers that are kept in memory at the same time.
+
+    Returns
+    -------
+    imgbuffer : int
+        Number of images to read at once.
+    """
+    for timestamp in timestamps:
+        try:
+            filename = input_dataset._build_filename(timestamp)
+            break
+        except IOError:
+            continue
+    else:
+        return 1
+
+    parameters = input_dataset.ioclass_kws['parameter']
+    with Dataset(filename) as ds:
+        if parameters is None:
+            parameters = [p for p in ds.variables.keys()
+                          if p not in ['lat', 'lon', 'time']]
+        elif isinstance(parameters, str):
+            parameters = [parameters]
+        itemsize = sum(ds.variables[p].dtype.itemsize for p in parameters)
+
+    # the image stack is copied once when sorting it by cell
+    image_size = (n_buffers + 1) * itemsize * input_dataset.grid.activegpis.size
+
+    available = memory_limit - (current_rss() or 0)
+    return int(min(max(1, available // image_size), max(1, len(timestamps))))
+
+
 def str2bool(val):
     if val in ['True', 'true', 't', 'T', '1']:
         return True
     else:
         return False
 
+
+def parse_catalog(val):
+    """
+    Parse the catalog command line option, which is either a boolean or
+    the path to a catalog file.
+
+    Parameters
+    ----------
+    val : str
+        Value passed on the command line.
+
+    Returns
+    -------
+    catalog : bool or str or None
+        True to store the catalog in the input root, None to use no catalog,
+        otherwise the path to the catalog file.
+    """
+    if val in ['True', 'true', 't', 'T', '1']:
+        return True
+    if val in ['False', 'false', 'f', 'F', '0']:
+        return None
+    return val
+
+def parse_var_option(values, convert):
+    """
+    Parse a command line option that is either one value for all parameters
+    or a list of parameter=value pairs.
+
+    Parameters
+    ----------
+    values : list or None
+        Values passed on the command line.
+    convert : callable
+        Function to convert each value.
+
+    Returns
+    -------
+    option : object or dict or None
+        Converted value, or a dict with parameter names as keys.
+    """
+    if values is None:
+        return None
+    if len(values) == 1 and '=' not in values[0]:
+        return convert(values[0])
+
+    option = {}
+    for value in values:
+        name, value = value.split('=')
+        option[name] = convert(value)
+    return option
+
 def mkdate(datestring):
     if len(datestring) == 10:
         return datetime.strptime(datestring, '%Y-%m-%d')
@@ -58,7 +449,7 @@ def mkdate(datestring):
         return datetime.strptime(datestring, '%Y-%m-%dT%H:%M')
 
 
-def parse_filename(data_dir):
+def parse_filename(data_dir, catalog=None):
     '''
     Take the first file in the passed directory and use its file name to
     retrieve the product type, version number and variables in the file.
@@ -67,6 +458,9 @@ def parse_filename(data_dir):
     ----------
     inroot : str
         Input root directory
+    catalog : CCICatalog, optional (default: None)
+        Catalog of the files in the input directory. If passed, the first
+        file is taken from the catalog instead of walking the directory.
 
     Returns
     -------
@@ -75,8 +469,19 @@ def parse_filename(data_dir):
     file_vars : list
         Names of parameters in the first detected file
     '''
-    template = '{product}-SOILMOISTURE-L3S-{data_type}-{sensor_type}-' \
-               '{datetime}000000-fv{version}.{sub_version}.nc'
+    if catalog is not None:
+        for entry in catalog:
+            file_args = {'product': entry.product,
+                         'data_type': entry.data_type,
+                         'sensor_type': entry.sensor_type,
+                         'datetime': '{datetime}',
+                         'version': entry.version,
+                         'sub_version': entry.sub_version}
+            with Dataset(entry.path) as ds:
+                file_vars = list(ds.variables.keys())
+            return file_args, file_vars
+
+    template = fname_templ
 
     for curr, subdirs, files in os.walk(data_dir):
         for f in files:
@@ -153,16 +558,27 @@ def read_metadata(sensortype, version, varnames):
 def reshuffle(input_root, outputpath,
               startdate, enddate,
               parameters=None, land_points=True, ignore_meta=False,
-              imgbuffer=200):
+              imgbuffer=200, catalog=None, workers=1, append=False,
+              resume=False, memory_limit=None, engine='img2ts',
+              staging_dir=None, complevel=4, shuffle=True, chunksizes=None,
+              least_significant_digit=None, pack=None, pipelined=False,
+              profiler=None, bbox=None, cells=None, mask_file=None,
+              mask_variable=None):
     """
     Reshuffle method applied to ESA CCI SM images.
 
     Parameters
     ----------
-    input_root: string
+    input_root: string or list
         input path where era interim data was downloaded
-    outputpath : string
-        Output path.
+        A list of input paths (e.g. of the ACTIVE, PASSIVE and COMBINED
+        products) converts all products in one run, that shares the grid
+        and worker processes. Each worker converts all products for its
+        cells.
+    outputpath : string or list
+        Output path. For several input roots, either one output path per
+        input root, or a path in which a sub-folder is created for each
+        product (named after the sensor type, e.g. 'combined').
     startdate : datetime
         Start date.
     enddate : datetime
@@ -176,38 +592,640 @@ def reshuffle(input_root, outputpath,
         Leads to faster processing and smaller files.
     imgbuffer: int, optional
         How many images to read at once before writing time series.
+    catalog: bool or str, optional (default: None)
+        Use a catalog of the input files instead of searching the file system
+        for each date. If True is passed, the catalog is stored in the
+        input root, a string is used as the path to the catalog file.
+    workers: int, optional (default: 1)
+        Number of processes to reshuffle with. The cells of the grid are
+        split into groups with about the same number of points, each
+        process reshuffles the cells of one group.
+    append: bool, optional (default: False)
+        Extend existing time series in the output path. Only images after
+        the last time stamp in the existing time series are converted and
+        appended to the cell files.
+    resume: bool, optional (default: False)
+        Continue an interrupted run. The progress of each run is stored in a
+        journal in the output path. Cell files that were written after the
+        last complete image buffer are cut back to it, corrupt or missing
+        cell files are created again, then the run continues with the next
+        image buffer. Groups of cells (and products) that were finished are
+        not converted again, the journals are removed when the whole run is
+        complete. Parameters and workers must be the same as for the
+        interrupted run.
+    memory_limit: int or str, optional (default: None)
+        Memory that the conversion should not exceed, in bytes or with a
+        unit (e.g. '16GB'). It is shared between the workers. If passed, the
+        number of images to read at once is estimated from the size of the
+        images and the grid (imgbuffer is ignored), and reduced at runtime
+        if the measured memory use is higher than the limit.
+    engine: str, optional (default: 'img2ts')
+        'img2ts' extends all cell files after reading each image buffer.
+        'staging' first reads all images into memory-mapped arrays on disk
+        and then writes each cell file once, see
+        :class:`esa_cci_sm.staging.StagingImg2Ts`.
+    staging_dir: str, optional (default: None)
+        Directory for the staging arrays of the 'staging' engine. If None is
+        passed, the default temporary directory is used.
+    complevel: int, optional (default: 4)
+        zlib compression level (1-9) of the time series variables.
+    shuffle: bool, optional (default: True)
+        Apply the HDF5 shuffle filter before compression.
+    chunksizes: tuple or dict, optional (default: None)
+        (locations, time) chunk shape of the time series variables, or a
+        dict with a chunk shape for each parameter. Small location chunks
+        make reading single time series faster. If None is passed, chunks
+        contain all points of a cell and 1000 time stamps.
+    least_significant_digit: int or dict, optional (default: None)
+        Quantize the data to this number of decimal digits (lossy, but
+        improves compression), or a dict with the digits for each parameter.
+    pack: bool or list or dict, optional (default: None)
+        Store parameters as int16 values with scale_factor and add_offset
+        attributes (unpacked automatically when reading). The values are
+        rounded to 1/65534 of their valid range. If True is passed, all
+        parameters with a valid_range in the metadata ini file are packed.
+        A list selects parameters to pack with their valid_range from the
+        metadata. A dict can contain (scale_factor, add_offset) for each
+        parameter (or None to use the metadata).
+    pipelined: bool, optional (default: False)
+        Read the next image buffer in a separate process while the previous
+        one is written to the time series files (double buffering). Only
+        used by the 'img2ts' engine.
+    profiler: Profiler, optional (default: None)
+        Profiler that collects the time spent searching, opening, reading
+        and gathering images and writing the time series, the number of
+        images and bytes read and written and the peak memory use, see
+        :class:`esa_cci_sm.profiling.Profiler`. The statistics of worker
+        processes are added to it when they are done.
+    bbox: tuple, optional (default: None)
+        (min_lon, min_lat, max_lon, max_lat) of the region to reshuffle.
+    cells: list, optional (default: None)
+        Numbers of the (5 DEG) cells to reshuffle.
+    mask_file: str, optional (default: None)
+        Netcdf file with a (lat, lon) mask of the region to reshuffle, or a
+        grid file, see :func:`esa_cci_sm.grid.mask_file_gpis`.
+    mask_variable: str, optional (default: None)
+        Name of the mask variable in the mask file, needed if the file
+        contains more than one (lat, lon) variable.
+
+    The region options are combined with each other and with land_points.
+    For a region, only the bounding window of its points is read from each
+    image.
     """
-    if land_points:
-        grid = CCILandGrid()
+    if engine not in ['img2ts', 'staging']:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    region = dict(land_points=land_points, bbox=bbox, cells=cells,
+                  mask_file=mask_file, mask_variable=mask_variable)
+    grid = CCIRegionGrid(**region)
+    regional = (bbox is not None) or (cells is not None) or \
+        (mask_file is not None)
+
+    if isinstance(input_root, str):
+        input_roots, outputpaths = [input_root], [outputpath]
+    elif isinstance(outputpath, str):
+        # one sub-folder per product, named after the sensor type
+        input_roots, outputpaths = list(input_root), [None] * len(input_root)
     else:
-        grid = CCICellGrid()
+        input_roots, outputpaths = list(input_root), list(outputpath)
+        if len(input_roots) != len(outputpaths):
+            raise ValueError("Pass one output path for each input root.")
+
+    if isinstance(catalog, str) and len(input_roots) > 1:
+        raise ValueError("Pass catalog=True to use a catalog for each of "
+                         "several input roots.")
+
+    if workers <= 1:
+        cell_groups = [np.unique(grid.activearrcell)]
+    else:
+        cell_groups = partition_cells(grid, workers)
+
+    if memory_limit is not None:
+        memory_limit = parse_size(memory_limit) // len(cell_groups)
+
+    products = []
+    for root, path in zip(input_roots, outputpaths):
+        product = _prepare_product(
+            root, path, outputpath, startdate, enddate, grid, len(cell_groups),
+            parameters=parameters, ignore_meta=ignore_meta, catalog=catalog,
+            append=append, resume=resume, pack=pack,
+            encoding_kws=dict(complevel=complevel, shuffle=shuffle,
+                              chunksizes=chunksizes,
+                              least_significant_digit=least_significant_digit),
+            imgbuffer=imgbuffer, memory_limit=memory_limit, engine=engine,
+            staging_dir=staging_dir, pipelined=pipelined)
+        if product is not None:
+            products.append(product)
+
+    if len(cell_groups) == 1:
+        for product in products:
+            _reshuffle_group(product['input_root'], product['outputpath'],
+                             product['startdate'], enddate, grid, 0,
+                             product['journals'].get(0), windowed=regional,
+                             profiler=profiler, **product['kwargs'])
+        for product in products:
+            _remove_journals(product['outputpath'])
+        return
+
+    # each worker converts all products for its cells and writes its own
+    # grid files, the grid for all points is written once at the end
+    tmp_dirs = [tempfile.mkdtemp(dir=product['outputpath'])
+                for product in products]
+    try:
+        with ProcessPoolExecutor(max_workers=len(cell_groups)) as pool:
+            futures = []
+            for i, group_cells in enumerate(cell_groups):
+                group_products = [
+                    dict(product, journal=product['journals'].get(i),
+                         gridname=os.path.join(tmp_dir, f'grid_{i}.nc'))
+                    for product, tmp_dir in zip(products, tmp_dirs)]
+                futures.append(pool.submit(
+                    _reshuffle_cells, region, group_cells, i, group_products,
+                    enddate, profile=profiler is not None,
+                    report_interval=None if profiler is None
+                    else profiler.report_interval))
+            for future in futures:
+                report = future.result()
+                if profiler is not None:
+                    profiler.merge(report)
+    finally:
+        for tmp_dir in tmp_dirs:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for product in products:
+        save_grid(os.path.join(product['outputpath'], 'grid.nc'), grid)
+    # only now, a resumed run must skip the groups that were finished
+    for product in products:
+        _remove_journals(product['outputpath'])
+
+
+def _prepare_product(input_root, outputpath, output_root, startdate, enddate,
+                     grid, n_groups, parameters, ignore_meta, catalog, append,
+                     resume, pack, encoding_kws, **kwargs):
+    """
+    Find the files, metadata, dates and journals of the reshuffle of one
+    product, see :func:`reshuffle`.
+
+    Returns
+    -------
+    product : dict or None
+        Input root, output path, start date and journals of the product and
+        the keyword arguments for :func:`_reshuffle_group`. None if there is
+        nothing to append.
+    """
+    if catalog:
+        index_file = None if catalog is True else catalog
+        catalog = CCICatalog(input_root, index_file=index_file)
+    else:
+        catalog = None
+
+    file_args, file_vars = parse_filename(input_root, catalog=catalog)
+
+    if outputpath is None:
+        outputpath = os.path.join(output_root, file_args['sensor_type'].lower())
 
     if not os.path.exists(outputpath):
         os.makedirs(outputpath)
 
-    file_args, file_vars = parse_filename(input_root)
+    journals = _read_journals(outputpath) if resume else {}
+    if journals:
+        # continue with the dates of the interrupted run
+        startdate = min(datetime.strptime(j['startdate'], _journal_dt_fmt)
+                        for j in journals.values())
+        append = False
+
+    # groups without journal had not started this product
+    if not set(journals.keys()) <= set(range(n_groups)):
+        raise ValueError("The interrupted run used a different number of "
+                         "workers, resume with the same number of workers.")
+
+    coverage_start = None
+    if append:
+        coverage = ts_time_coverage(outputpath)
+        if len(coverage) > 0:
+            existing_grid = load_grid(os.path.join(outputpath, 'grid.nc'))
+            if not np.array_equal(np.sort(existing_grid.activegpis),
+                                  np.sort(grid.activegpis)):
+                raise ValueError("The existing time series are on a different "
+                                 "grid, check the land_points and region settings.")
+
+            first = min(c[0] for c in coverage.values())
+            lasts = set(c[1] for c in coverage.values())
+            if len(lasts) > 1:
+                raise IOError(f"The time series in {outputpath} end at "
+                              f"different dates, can not append.")
+            last = lasts.pop()
+
+            coverage_start = str(first)
+            startdate = max(startdate, last + timedelta(days=1))
+            if startdate > enddate:
+                warnings.warn(f"Time series already end at {last}, nothing "
+                              f"to append.")
+                return None
 
     if parameters is None:
         parameters = [p for p in file_vars if p not in ['lat', 'lon', 'time']]
 
-    input_dataset = CCI_SM_025Ds(data_path=input_root, parameter=parameters,
-                                 subgrid=grid, array_1D=True)
-
     if not ignore_meta:
         global_attr, ts_attributes = read_metadata(sensortype=file_args['sensor_type'],
                                                    version=int(file_args['version']),
                                                    varnames=parameters)
-        global_attr['time_coverage_start'] = str(startdate)
+        global_attr['time_coverage_start'] = str(startdate) \
+            if coverage_start is None else coverage_start
         global_attr['time_coverage_end'] = str(enddate)
     else:
         global_attr = {'product': 'ESA CCI SM'}
         ts_attributes = None
 
+    packing = get_packing(pack, parameters, file_args)
+
+    kwargs.update(parameters=parameters, catalog=catalog,
+                  global_attr=global_attr, ts_attributes=ts_attributes,
+                  encoding=build_encoding(parameters, packing=packing,
+                                          **encoding_kws))
 
-    reshuffler = Img2Ts(input_dataset=input_dataset, outputpath=outputpath,
-                        startdate=startdate, enddate=enddate, input_grid=grid,
-                        imgbuffer=imgbuffer, global_attr=global_attr, zlib=True,
-                        unlim_chunksize=1000, ts_attributes=ts_attributes)
+    return {'input_root': input_root, 'outputpath': outputpath,
+            'startdate': startdate, 'journals': journals, 'kwargs': kwargs}
+
+
+def get_packing(pack, parameters, file_args):
+    """
+    Get the scale factor and offset of the parameters to pack.
+
+    Parameters
+    ----------
+    pack : bool or list or dict or None
+        Parameters to pack, see :func:`reshuffle`.
+    parameters : list
+        Parameters that are reshuffled.
+    file_args : dict
+        Sensor type and version of the images, to find the metadata.
+
+    Returns
+    -------
+    packing : dict or None
+        Parameter names as keys and (scale_factor, add_offset) as values.
+    """
+    if not pack:
+        return None
+
+    strict = pack is not True
+    if pack is True:
+        pack = {p: None for p in parameters}
+    elif not isinstance(pack, dict):
+        pack = {p: None for p in pack}
+
+    unknown = [p for p in pack.keys() if p not in parameters]
+    if unknown:
+        raise ValueError(f"Can not pack {unknown}, they are not reshuffled.")
+
+    _, var_meta = read_metadata(sensortype=file_args['sensor_type'],
+                                version=int(file_args['version']),
+                                varnames=[p for p, v in pack.items() if v is None])
+
+    packing = {}
+    for parameter, params in pack.items():
+        if params is None:
+            valid_range = var_meta[parameter].get('valid_range')
+            if valid_range is None:
+                if strict:
+                    raise ValueError(f"No valid_range for {parameter} in the "
+                                     f"metadata, pass the packing parameters.")
+                continue
+            params = packing_params(*valid_range)
+        packing[parameter] = params
+
+    return packing
+
+
+def ts_time_coverage(outputpath):
+    """
+    Find the first and last time stamp in each time series cell file in a
+    directory.
+
+    Parameters
+    ----------
+    outputpath : str
+        Directory that contains the time series files.
+
+    Returns
+    -------
+    coverage : dict
+        Cell file names as keys and (first, last) datetime as values. Files
+        that do not contain any time stamps are not included.
+    """
+    coverage = {}
+    for fname in sorted(os.listdir(outputpath)):
+        if not fname.endswith('.nc') or fname == 'grid.nc':
+            continue
+        with Dataset(os.path.join(outputpath, fname)) as ds:
+            if 'time' not in ds.variables or ds.variables['time'].size == 0:
+                continue
+            time = ds.variables['time']
+            dates = num2date(time[[0, -1]], units=time.units,
+                             calendar=getattr(time, 'calendar', 'standard'),
+                             only_use_cftime_datetimes=False,
+                             only_use_python_datetimes=True)
+            coverage[fname] = (dates[0], dates[-1])
+
+    return coverage
+
+
+def partition_cells(grid, n):
+    """
+    Split the cells of a grid into (at most) n groups of neighbouring cells
+    with about the same number of grid points.
+
+    Parameters
+    ----------
+    grid : CellGrid
+        Grid to split.
+    n : int
+        Number of groups.
+
+    Returns
+    -------
+    cell_groups : list[np.array]
+        Sorted cell numbers of each group.
+    """
+    cells, counts = np.unique(grid.activearrcell, return_counts=True)
+    n = max(1, min(n, len(cells)))
+    # split where the cumulative number of points passes a multiple of n_gpi/n
+    bounds = np.searchsorted(np.cumsum(counts),
+                             np.arange(1, n) * (counts.sum() / n))
+    groups = np.split(cells, np.unique(bounds + 1))
+
+    return [g for g in groups if len(g) > 0]
+
+
+def _reshuffle_cells(region, cells, group, products, enddate, profile=False,
+                     report_interval=None):
+    """
+    Reshuffle all products for the points in the passed cells of the region
+    grid (see :func:`esa_cci_sm.grid.CCIRegionGrid`), called in a worker
+    process. The grid is created once for all products.
+    Returns the profiler report of the worker (empty if profile is False).
+    """
+    grid = CCIRegionGrid(**region).subgrid_from_cells(cells)
+
+    profiler = Profiler(report_interval=report_interval,
+                        label=f"worker {group}") if profile else None
+
+    for product in products:
+        _reshuffle_group(product['input_root'], product['outputpath'],
+                         product['startdate'], enddate, grid, group,
+                         product['journal'], windowed=True,
+                         gridname=product['gridname'], profiler=profiler,
+                         **product['kwargs'])
+
+    return {} if profiler is None else profiler.report()
+
+
+def _reshuffle_group(input_root, outputpath, startdate, enddate, grid, group,
+                     journal, **kwargs):
+    """
+    Reshuffle the images for all points of a grid, keep track of the progress
+    in the journal of the group and resume from the passed journal.
+    The journal is marked as finished at the end, it is removed when all
+    groups are finished (see :func:`_remove_journals`).
+    """
+    journal_file = _journal_file(outputpath, group)
+    cells = np.unique(grid.activearrcell).tolist()
+
+    if journal is None:
+        journal = {'startdate': startdate.strftime(_journal_dt_fmt),
+                   'parameters': kwargs['parameters'],
+                   'cells': cells,
+                   'done_until': None,
+                   'finished': False}
+        _write_journal(journal_file, journal)
+    else:
+        if (journal['cells'] != cells) or \
+                (journal['parameters'] != kwargs['parameters']):
+            raise ValueError(f"Settings of the interrupted run in {journal_file} "
+                             f"do not match, can not resume.")
+        if journal.get('finished', False):
+            return
+        startdate = _repair_cells(input_root, outputpath, grid, journal,
+                                  **kwargs)
+
+    def checkpoint(timestamp):
+        journal['done_until'] = timestamp.strftime(_journal_dt_fmt)
+        _write_journal(journal_file, journal)
+
+    if startdate <= enddate:
+        _reshuffle_grid(input_root, outputpath, startdate, enddate, grid,
+                        checkpoint=checkpoint, **kwargs)
+
+    journal['finished'] = True
+    _write_journal(journal_file, journal)
+
+
+def _repair_cells(input_root, outputpath, grid, journal, gridname='grid.nc',
+                  **kwargs):
+    """
+    Bring the cell files of an interrupted run back to the last complete
+    image buffer in the journal.
+
+    Returns
+    -------
+    startdate : datetime
+        Date to continue the run from.
+    """
+    startdate = datetime.strptime(journal['startdate'], _journal_dt_fmt)
+    if journal['done_until'] is None:
+        # nothing was completed, remove all data written by the run
+        for cell in journal['cells']:
+            fname = os.path.join(outputpath, '%04d.nc' % cell)
+            if os.path.exists(fname) and \
+                    not truncate_cell_file(fname, startdate - timedelta(days=1)):
+                os.remove(fname)
+        return startdate
+
+    done_until = datetime.strptime(journal['done_until'], _journal_dt_fmt)
+
+    rebuild = []
+    for cell in journal['cells']:
+        fname = os.path.join(outputpath, '%04d.nc' % cell)
+        if not (os.path.exists(fname) and truncate_cell_file(fname, done_until)):
+            rebuild.append(cell)
+
+    if rebuild:
+        warnings.warn(f"Cells {rebuild} are missing or corrupt and are "
+                      f"created again from {startdate} on.")
+        for cell in rebuild:
+            fname = os.path.join(outputpath, '%04d.nc' % cell)
+            if os.path.exists(fname):
+                os.remove(fname)
+        tmp_dir = tempfile.mkdtemp(dir=outputpath)
+        try:
+            _reshuffle_grid(input_root, outputpath, startdate, done_until,
+                            grid.subgrid_from_cells(rebuild),
+                            gridname=os.path.join(tmp_dir, 'grid.nc'),
+                            **kwargs)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return done_until + timedelta(days=1)
+
+
+def truncate_cell_file(filename, end_date):
+    """
+    Remove all time stamps after the passed date from a time series cell
+    file. The file is rewritten if necessary.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the cell file.
+    end_date : datetime
+        Last date to keep.
+
+    Returns
+    -------
+    valid : bool
+        False if the file could not be read, or contains no data until the
+        end date.
+    """
+    try:
+        with Dataset(filename) as src:
+            time = src.variables['time']
+            calendar = getattr(time, 'calendar', 'standard')
+            times = time[:]
+            n_keep = int(np.sum(times <= date2num(end_date, time.units,
+                                                  calendar=calendar)))
+            if n_keep == 0:
+                return False
+            if n_keep == len(times):
+                return True
+
+            tmp_file = filename + '.tmp'
+            try:
+                _copy_time_slice(src, tmp_file, time.dimensions[0], n_keep)
+            except Exception:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                raise
+    except (OSError, KeyError, RuntimeError):
+        return False
+
+    os.replace(tmp_file, filename)
+    return True
+
+
+def _copy_time_slice(src, filename, time_dim, n):
+    """
+    Copy a netcdf dataset, with only the first n elements along the time
+    dimension.
+    """
+    with Dataset(filename, 'w', format=src.file_format) as dst:
+        dst.setncatts({a: src.getncattr(a) for a in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            filters = var.filters() or {}
+            chunking = var.chunking()
+            attrs = {a: var.getncattr(a) for a in var.ncattrs()}
+            fill_value = attrs.pop('_FillValue', None)
+            out = dst.createVariable(
+                name, var.datatype, var.dimensions,
+                zlib=filters.get('zlib', False),
+                complevel=filters.get('complevel', 4),
+                shuffle=filters.get('shuffle', False),
+                chunksizes=None if chunking == 'contiguous' else chunking,
+                fill_value=fill_value)
+            out.setncatts(attrs)
+
+            var.set_auto_maskandscale(False)
+            out.set_auto_maskandscale(False)
+            index = tuple(slice(0, n) if d == time_dim else slice(None)
+                          for d in var.dimensions)
+            out[index] = var[index]
+
+
+_journal_dt_fmt = '%Y-%m-%dT%H:%M:%S'
+
+
+def _journal_file(outputpath, group):
+    return os.path.join(outputpath, f'.reshuffle_journal_{group}.json')
+
+
+def _write_journal(filename, journal):
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(journal, f)
+    os.replace(tmp_file, filename)
+
+
+def _read_journals(outputpath):
+    """
+    Read the journals of an interrupted run.
+
+    Returns
+    -------
+    journals : dict
+        Group numbers as keys and journal dicts as values.
+    """
+    journals = {}
+    if not os.path.isdir(outputpath):
+        return journals
+    for fname in os.listdir(outputpath):
+        group = parse('.reshuffle_journal_{:d}.json', fname)
+        if group is None:
+            continue
+        with open(os.path.join(outputpath, fname), 'r') as f:
+            journals[group[0]] = json.load(f)
+
+    return journals
+
+
+def _remove_journals(outputpath):
+    """
+    Remove the journals of all groups, after the run is complete.
+    """
+    for group in _read_journals(outputpath).keys():
+        os.remove(_journal_file(outputpath, group))
+
+
+def _reshuffle_grid(input_root, outputpath, startdate, enddate, grid,
+                    parameters, catalog, global_attr, ts_attributes,
+                    imgbuffer, gridname='grid.nc', windowed=False,
+                    checkpoint=None, memory_limit=None, engine='img2ts',
+                    staging_dir=None, encoding=None, pipelined=False,
+                    profiler=None):
+    """
+    Reshuffle the images for all points of a grid.
+    """
+    input_dataset = CCI_SM_025Ds(data_path=input_root, parameter=parameters,
+                                 subgrid=grid, array_1D=True, catalog=catalog,
+                                 only_available=True, windowed=windowed,
+                                 profiler=profiler)
+
+    if memory_limit is not None:
+        imgbuffer = estimate_imgbuffer(
+            input_dataset,
+            input_dataset.tstamps_for_daterange(startdate, enddate),
+            memory_limit, n_buffers=2 if pipelined else 1)
+
+    if engine == 'staging':
+        reshuffler = StagingImg2Ts(input_dataset=input_dataset,
+                                   outputpath=outputpath, startdate=startdate,
+                                   enddate=enddate, input_grid=grid,
+                                   imgbuffer=imgbuffer, global_attr=global_attr,
+                                   ts_attributes=ts_attributes, zlib=True,
+                                   unlim_chunksize=1000, gridname=gridname,
+                                   staging_dir=staging_dir,
+                                   checkpoint=checkpoint, encoding=encoding,
+                                   profiler=profiler)
+    else:
+        reshuffler = CCIImg2Ts(input_dataset=input_dataset, outputpath=outputpath,
+                               startdate=startdate, enddate=enddate, input_grid=grid,
+                               imgbuffer=imgbuffer, global_attr=global_attr, zlib=True,
+                               unlim_chunksize=1000, ts_attributes=ts_attributes,
+                               gridname=gridname, checkpoint=checkpoint,
+                               memory_limit=memory_limit, encoding=encoding,
+                               pipelined=pipelined, profiler=profiler)
     reshuffler.calc()
 
 
@@ -228,8 +1246,11 @@ def parse_args(args):
 
     parser = argparse.ArgumentParser(
         description="Convert ESA CCI image data to time series format.")
-    parser.add_argument("dataset_root",
-                        help='Root of local filesystem where the data is stored.')
+    parser.add_argument("dataset_root", nargs="+",
+                        help=("Root of local filesystem where the data is stored. "
+                              "Pass several roots (e.g. of the active, passive and "
+                              "combined product) to convert them in one run, into "
+                              "sub-folders of the timeseries root."))
     parser.add_argument("timeseries_root",
                         help='Root of local filesystem where the timeseries should be stored.')
     parser.add_argument("start", type=mkdate,
@@ -247,11 +1268,87 @@ def parse_args(args):
                               " in the SMECV-grid land mask (faster and less/smaller files)"))
     parser.add_argument("--ignore_meta", type=str2bool, default='True',
                         help=("Do not apply metadata from ini files to the time series"))
+    parser.add_argument("--bbox", type=float, default=None, nargs=4,
+                        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+                        help=("Only convert the points in this bounding box."))
+    parser.add_argument("--cells", type=int, default=None, nargs="+",
+                        help=("Only convert the points in these (5 DEG) cells."))
+    parser.add_argument("--mask_file", "--mask-file", type=str, default=None,
+                        help=("Only convert the points that are selected (not 0) in "
+                              "this netcdf file with a (lat, lon) mask variable, or "
+                              "the points of this grid file."))
+    parser.add_argument("--mask_variable", type=str, default=None,
+                        help=("Name of the mask variable in the mask file."))
     parser.add_argument("--imgbuffer", type=int, default=200,
                         help=("How many images to read at once. Bigger numbers make the "
                               "conversion faster but consume more memory."))
+    parser.add_argument("--memory_limit", "--memory-limit", type=str, default=None,
+                        help=("Memory that the conversion should not exceed, e.g. 16GB. "
+                              "The number of images to read at once is then derived "
+                              "from it and --imgbuffer is ignored."))
+    parser.add_argument("--engine", type=str, default='img2ts',
+                        choices=['img2ts', 'staging'],
+                        help=("'img2ts' extends the time series after each image buffer, "
+                              "'staging' collects all images on disk first and writes "
+                              "each time series file once."))
+    parser.add_argument("--staging_dir", type=str, default=None,
+                        help=("Directory for the temporary files of the staging engine."))
+    parser.add_argument("--complevel", type=int, default=4,
+                        help=("zlib compression level (1-9) of the time series."))
+    parser.add_argument("--shuffle", type=str2bool, default='True',
+                        help=("Apply the shuffle filter before compression."))
+    parser.add_argument("--chunksizes", type=str, default=None, nargs="+",
+                        help=("Chunk shape (locations,time) of the time series variables, "
+                              "e.g. 1,5000. Use parameter=locations,time (e.g. "
+                              "sm=1,5000) to set it for single parameters."))
+    parser.add_argument("--least_significant_digit", type=str, default=None,
+                        nargs="+",
+                        help=("Quantize the time series to this number of decimal digits "
+                              "(lossy). Use parameter=digits (e.g. sm=4) to set it "
+                              "for single parameters."))
+    parser.add_argument("--pack", type=str, default=None, nargs="+",
+                        help=("Store parameters as int16 with scale_factor and add_offset. "
+                              "True packs all parameters with a valid range in the "
+                              "metadata, otherwise pass parameter names (e.g. sm) or "
+                              "parameter=scale_factor,add_offset (e.g. sm=1e-5,0.5)."))
+    parser.add_argument("--pipelined", type=str2bool, default='False',
+                        help=("Set True to read the next images while the previous "
+                              "ones are written (uses memory for two image buffers)."))
+    parser.add_argument("--profile_report", "--profile-report", type=str,
+                        default=None,
+                        help=("Path of a json file to write the time spent in each "
+                              "stage, the number of images and bytes processed and "
+                              "the peak memory use to. A summary is also printed "
+                              "every minute."))
+    parser.add_argument("--catalog", type=parse_catalog, default=None, nargs="?",
+                        const=True,
+                        help=("Use a catalog (index) of the input images to find the "
+                              "image files instead of searching the file system. It "
+                              "is created or updated if necessary. Without a value "
+                              "(or with True) the catalog is stored in each input "
+                              "root, otherwise pass the path to the catalog file "
+                              "(only for a single input root)."))
+    parser.add_argument("--append", type=str2bool, default='False',
+                        help=("Set True to extend existing time series in the output "
+                              "path with images after their last time stamp."))
+    parser.add_argument("--resume", type=str2bool, default='False',
+                        help=("Set True to continue an interrupted conversion into "
+                              "the same output path."))
+    parser.add_argument("--workers", type=int, default=1,
+                        help=("Number of processes to use. Each process converts "
+                              "a separate group of cells."))
     args = parser.parse_args(args)
     # set defaults that can not be handled by argparse
+    args.chunksizes = parse_var_option(
+        args.chunksizes, lambda v: tuple(int(c) for c in v.split(',')))
+    args.least_significant_digit = parse_var_option(
+        args.least_significant_digit, int)
+    if args.pack is not None and len(args.pack) == 1 and \
+            args.pack[0] in ['True', 'true', 'False', 'false']:
+        args.pack = str2bool(args.pack[0])
+    elif args.pack is not None:
+        args.pack = {v.split('=')[0]: tuple(float(p) for p in v.split('=')[1].split(','))
+                     if '=' in v else None for v in args.pack}
 
     print("Converting data from {} to {} into folder {}.".format(args.start.isoformat(),
                                                                  args.end.isoformat(),
@@ -261,6 +1358,12 @@ def parse_args(args):
 
 def main(args):
     args = parse_args(args)
+    if len(args.dataset_root) == 1:
+        args.dataset_root = args.dataset_root[0]
+
+    profiler = None
+    if args.profile_report is not None:
+        profiler = Profiler(report_interval=60)
 
     reshuffle(args.dataset_root,
               args.timeseries_root,
@@ -269,7 +1372,29 @@ def main(args):
               args.parameters,
               land_points=args.land_points,
               ignore_meta=args.ignore_meta,
-              imgbuffer=args.imgbuffer)
+              imgbuffer=args.imgbuffer,
+              catalog=args.catalog,
+              workers=args.workers,
+              append=args.append,
+              resume=args.resume,
+              memory_limit=args.memory_limit,
+              engine=args.engine,
+              staging_dir=args.staging_dir,
+              complevel=args.complevel,
+              shuffle=args.shuffle,
+              chunksizes=args.chunksizes,
+              least_significant_digit=args.least_significant_digit,
+              pack=args.pack,
+              pipelined=args.pipelined,
+              profiler=profiler,
+              bbox=args.bbox,
+              cells=args.cells,
+              mask_file=args.mask_file,
+              mask_variable=args.mask_variable)
+
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.save(args.profile_report)
 
 
 def run():
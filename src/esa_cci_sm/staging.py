@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Conversion of image stacks into time series via a memory-mapped staging cube
+on disk, so that each time series cell file is written only once.
+'''
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from pygeogrids.netcdf import save_grid
+
+from esa_cci_sm.encoding import write_cell_ts
+from esa_cci_sm.profiling import profiled
+
+
+class StagingImg2Ts(object):
+    """
+    Alternative to Img2Ts for long periods. All images are first read into
+    one memory-mapped (n_gpi, n_times) array per parameter on local disk.
+    The grid points in these arrays are ordered by cell (and gpi within each
+    cell), so that the time series of a cell are contiguous. Afterwards each
+    cell file is written in a single pass, instead of being extended once
+    per image buffer.
+
+    The staging arrays need n_gpi * n_times * itemsize bytes of disk space
+    for each parameter.
+
+    Parameters
+    ----------
+    input_dataset : CCI_SM_025Ds
+        Dataset to read the images from, with the grid of the time series.
+    outputpath : str
+        Path where the time series are stored.
+    startdate : datetime
+        First date to convert.
+    enddate : datetime
+        Last date to convert.
+    input_grid : CellGrid
+        Grid of the time series, the grid of the input dataset.
+    imgbuffer : int, optional (default: 100)
+        Number of images to read at once.
+    global_attr : dict, optional (default: None)
+        Global attributes of the time series files.
+    ts_attributes : dict, optional (default: None)
+        Attributes of the time series variables.
+    zlib : bool, optional (default: True)
+        Compress the time series variables.
+    unlim_chunksize : int, optional (default: 100)
+        Chunk size along the time dimension.
+    gridname : str, optional (default: 'grid.nc')
+        File name of the grid file in the output path.
+    staging_dir : str, optional (default: None)
+        Directory to create the staging arrays in, should be on a fast local
+        disk. If None is passed, the default temporary directory is used.
+    checkpoint : callable, optional (default: None)
+        Called with the last time stamp when all cell files are written.
+    encoding : dict, optional (default: None)
+        Compression and chunking of the time series variables, see
+        :func:`esa_cci_sm.encoding.build_encoding`.
+    time_units : str, optional (default: "days since 1858-11-17 00:00:00")
+        Units of the time variable in the time series files.
+    profiler : Profiler, optional (default: None)
+        Profiler to time copying images into the staging arrays ('stage')
+        and writing the cell files ('write') with.
+    """
+
+    def __init__(self, input_dataset, outputpath, startdate, enddate,
+                 input_grid, imgbuffer=100, global_attr=None,
+                 ts_attributes=None, zlib=True, unlim_chunksize=100,
+                 gridname='grid.nc', staging_dir=None, checkpoint=None,
+                 encoding=None, time_units="days since 1858-11-17 00:00:00",
+                 profiler=None):
+
+        self.imgin = input_dataset
+        self.outputpath = outputpath
+        self.startdate = startdate
+        self.enddate = enddate
+        self.grid = input_grid
+        self.imgbuffer = imgbuffer
+        self.global_attr = global_attr
+        self.ts_attributes = ts_attributes
+        self.zlib = zlib
+        self.unlim_chunksize = unlim_chunksize
+        self.gridname = gridname
+        self.staging_dir = staging_dir
+        self.checkpoint = checkpoint
+        self.encoding = encoding
+        self.time_units = time_units
+        self.profiler = profiler
+
+    def _stage(self, stage_dir, order):
+        """
+        Read all images into the staging arrays.
+
+        Returns
+        -------
+        staged : dict
+            Parameter names as keys and memory-mapped (n_gpi, n_times)
+            arrays as values.
+        timestamps : list[datetime]
+            Time stamps of the images that were read.
+        """
+        timestamps = self.imgin.tstamps_for_daterange(self.startdate,
+                                                      self.enddate)
+        staged, read_timestamps = {}, []
+
+        for i in range(0, len(timestamps), self.imgbuffer):
+            img_dict, dates = self.imgin.read_stack(
+                timestamps[i:i + self.imgbuffer])
+            if len(dates) == 0:
+                continue
+
+            t0 = len(read_timestamps)
+            with profiled(self.profiler, 'stage'):
+                for parameter, stack in img_dict.items():
+                    if parameter not in staged:
+                        staged[parameter] = np.lib.format.open_memmap(
+                            os.path.join(stage_dir, f'{parameter}.npy'),
+                            mode='w+', dtype=stack.dtype,
+                            shape=(order.size, len(timestamps)))
+                    staged[parameter][:, t0:t0 + len(dates)] = stack[:, order].T
+
+            read_timestamps.extend(dates)
+
+        return staged, read_timestamps
+
+    def calc(self):
+        """
+        Read all images into the staging arrays and write the time series of
+        each cell.
+        """
+        save_grid(os.path.join(self.outputpath, self.gridname), self.grid)
+
+        if self.global_attr is None:
+            self.global_attr = {}
+
+        # cell major, sorted by gpi within each cell
+        order = np.lexsort((self.grid.activegpis, self.grid.activearrcell))
+        cells = self.grid.activearrcell[order]
+        gpis = self.grid.activegpis[order]
+        lons = self.grid.activearrlon[order]
+        lats = self.grid.activearrlat[order]
+
+        stage_dir = tempfile.mkdtemp(prefix='esa_cci_sm_staging_',
+                                     dir=self.staging_dir)
+        try:
+            staged, timestamps = self._stage(stage_dir, order)
+            if len(timestamps) == 0:
+                return
+
+            self.global_attr['time_coverage_end'] = str(timestamps[-1])
+            timestamps = np.array(timestamps)
+            n = len(timestamps)
+
+            values, starts = np.unique(cells, return_index=True)
+            ends = np.append(starts[1:], cells.size)
+            for cell, start, end in zip(values, starts, ends):
+                with profiled(self.profiler, 'write'):
+                    data = {p: np.asarray(v[start:end, :n])
+                            for p, v in staged.items()}
+                    write_cell_ts(os.path.join(self.outputpath, '%04d.nc' % cell),
+                                  gpis[start:end], lons[start:end],
+                                  lats[start:end], data, timestamps,
+                                  global_attr=self.global_attr,
+                                  ts_attributes=self.ts_attributes,
+                                  zlib=self.zlib,
+                                  unlim_chunksize=self.unlim_chunksize,
+                                  encoding=self.encoding,
+                                  time_units=self.time_units)
+                if self.profiler is not None:
+                    self.profiler.count('bytes_written',
+                                        sum(v.nbytes for v in data.values()))
+
+            del staged
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+        if self.profiler is not None:
+            self.profiler.update_memory()
+        if self.checkpoint is not None:
+            self.checkpoint(timestamps[-1])
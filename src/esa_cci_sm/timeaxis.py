@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 TU Wien
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Fast, cached decoding of the time variable of time series files.
+'''
+
+import re
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from netCDF4 import num2date
+
+# microseconds per time unit of the units attribute
+_unit_us = {'days': 86400000000, 'day': 86400000000, 'd': 86400000000,
+            'hours': 3600000000, 'hour': 3600000000, 'hrs': 3600000000,
+            'hr': 3600000000, 'h': 3600000000,
+            'minutes': 60000000, 'minute': 60000000, 'mins': 60000000,
+            'min': 60000000,
+            'seconds': 1000000, 'second': 1000000, 'secs': 1000000,
+            'sec': 1000000, 's': 1000000,
+            'milliseconds': 1000, 'millisecond': 1000, 'msec': 1000,
+            'ms': 1000,
+            'microseconds': 1, 'microsecond': 1, 'usec': 1, 'us': 1}
+
+# calendars that match numpy datetime64 after the gregorian reform
+_gregorian = ('standard', 'gregorian', 'proleptic_gregorian')
+_reform = np.datetime64('1582-10-15', 'us')
+
+_max_decoded = 16
+_decoded = OrderedDict()
+
+
+def decode_time(values, units, calendar='standard'):
+    """
+    Convert numeric time stamps (e.g. days since 1970-01-01) to datetime64.
+    The conversion is vectorized for the standard calendar, netCDF4.num2date
+    is used for other calendars.
+
+    The results are cached by units, calendar and a hash of the values, time
+    series files with the same time axis (e.g. all cell files of a dataset)
+    therefore share the decoded time stamps.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Numeric time stamps, e.g. of the time variable of a netcdf file.
+    units : str
+        Units of the time stamps, e.g. 'days since 1970-01-01 00:00:00'.
+    calendar : str, optional (default: 'standard')
+        Calendar of the time stamps.
+
+    Returns
+    -------
+    dates : np.ndarray
+        Time stamps as datetime64[ns], read only as they are shared.
+    """
+    values = np.ma.getdata(values) if np.ma.count_masked(values) == 0 \
+        else values
+    if isinstance(values, np.ma.MaskedArray):  # missing time stamps
+        return _num2date(values, units, calendar)
+
+    values = np.ascontiguousarray(values)
+    key = (units, calendar, values.dtype.str, values.shape,
+           hashlib.blake2b(values.tobytes(), digest_size=16).digest())
+    try:
+        dates = _decoded[key]
+        _decoded.move_to_end(key)
+        return dates
+    except KeyError:
+        pass
+
+    dates = _decode(values, units, calendar)
+    dates.flags.writeable = False
+    _decoded[key] = dates
+    if len(_decoded) > _max_decoded:
+        _decoded.popitem(last=False)
+
+    return dates
+
+
+def _decode(values, units, calendar):
+    """
+    Convert the time stamps with array operations if possible.
+    """
+    match = re.match(r'^\s*(\w+)\s+since\s+(.+?)\s*$', units)
+    if (match is None) or (match.group(1).lower() not in _unit_us) or \
+            (calendar.lower() not in _gregorian):
+        return _num2date(values, units, calendar)
+
+    try:
+        epoch = pd.Timestamp(match.group(2))
+    except ValueError:
+        return _num2date(values, units, calendar)
+    if epoch.tzinfo is not None:
+        epoch = epoch.tz_convert('UTC').tz_localize(None)
+    epoch = epoch.to_datetime64().astype('datetime64[us]')
+
+    factor = _unit_us[match.group(1).lower()]
+    if np.issubdtype(values.dtype, np.integer):
+        offsets = values.astype(np.int64) * factor
+    else:
+        offsets = np.round(values.astype(np.float64) * factor).astype(np.int64)
+    dates = epoch + offsets.astype('timedelta64[us]')
+
+    if (dates.size > 0) and (dates.min() < _reform) and \
+            (calendar.lower() != 'proleptic_gregorian'):
+        # julian calendar before the reform
+        return _num2date(values, units, calendar)
+
+    return dates.astype('datetime64[ns]')
+
+
+def _num2date(values, units, calendar):
+    """
+    Convert the time stamps with netCDF4.num2date.
+    """
+    dates = num2date(values, units=units, calendar=calendar,
+                     only_use_cftime_datetimes=False,
+                     only_use_python_datetimes=True)
+    return np.asarray(dates).astype('datetime64[ns]')
+
+
+def clear_cache():
+    """
+    Remove all decoded time stamps from the cache.
+    """
+    _decoded.clear()
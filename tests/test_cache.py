@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+import numpy.testing as nptest
+
+from esa_cci_sm.cache import DatasetPool
+from esa_cci_sm.interface import CCI_SM_025Ds
+
+
+def test_dataset_pool():
+    """
+    test reusing and evicting open files in the pool
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "combined", "2016")
+    files = [os.path.join(data_path, f) for f in sorted(os.listdir(data_path))]
+
+    pool = DatasetPool(max_open=1)
+    with pool.open(files[0]) as dataset:
+        assert 'sm' in dataset.variables
+    with pool.open(files[0]) as dataset:
+        assert dataset.isopen()
+    assert pool.stats() == {'open': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+    with pool.open(files[1]) as dataset:
+        # the first file is not in use and can be closed
+        assert files[0] not in pool
+    assert pool.evictions == 1
+    assert len(pool) == 1
+
+    pool.invalidate(files[1])
+    assert len(pool) == 0
+    pool.close()
+
+
+def test_CCI_SM_025Ds_handle_pool():
+    """
+    test that reading with a pool of open files gives the same results
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "combined")
+    pool = DatasetPool(max_open=4)
+
+    ds = CCI_SM_025Ds(data_path, parameter=['sm'], array_1D=True)
+    ds_pool = CCI_SM_025Ds(data_path, parameter=['sm'], array_1D=True,
+                           handle_pool=pool)
+
+    for _ in range(2):
+        img = ds.read(datetime(2016, 6, 7))
+        img_pool = ds_pool.read(datetime(2016, 6, 7))
+        nptest.assert_equal(img.data['sm'], img_pool.data['sm'])
+
+    assert pool.misses == 1
+    assert pool.hits == 1
+    pool.close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy.testing as nptest
+
+from esa_cci_sm.catalog import CCICatalog
+from esa_cci_sm.interface import CCI_SM_025Ds
+from esa_cci_sm.reshuffle import parse_filename
+from esa_cci_sm.grid import CCILandGrid
+
+
+def _copy_test_data(n_files=None):
+    """
+    Copy test images into a temporary directory that can be modified.
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "combined")
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, "2016"))
+    files = sorted(os.listdir(os.path.join(data_path, "2016")))
+    for f in files[:n_files]:
+        shutil.copy(os.path.join(data_path, "2016", f),
+                    os.path.join(root, "2016", f))
+    return data_path, root, files
+
+
+def test_catalog_lookup():
+    """
+    test finding files and dates with the catalog
+    """
+    data_path, root, files = _copy_test_data()
+    catalog = CCICatalog(root)
+
+    assert os.path.isfile(os.path.join(root, '.esa_cci_sm_catalog.json'))
+    assert len(catalog) == len(files)
+
+    timestamps = catalog.timestamps()
+    assert datetime(2016, 6, 7) in timestamps
+    assert catalog.timestamps(datetime(2016, 6, 7), datetime(2016, 6, 7)) == \
+           [datetime(2016, 6, 7)]
+    assert catalog.timestamps(datetime(2000, 1, 1), datetime(2000, 1, 2)) == []
+
+    entry = catalog.entries(datetime(2016, 6, 7))[0]
+    assert entry.path == os.path.join(root, "2016",
+        "ESACCI-SOILMOISTURE-L3S-SSMV-COMBINED-20160607000000-fv05.2.nc")
+    assert entry.sensor_type == 'COMBINED'
+    assert entry.version == '05'
+    assert entry.size == os.path.getsize(entry.path)
+    assert catalog.filenames(datetime(2000, 1, 1)) == []
+
+    file_args, file_vars = parse_filename(root, catalog=catalog)
+    assert file_args == parse_filename(root)[0]
+    assert 'sm' in file_vars
+
+
+def test_catalog_refresh():
+    """
+    test that new and removed files are found when the catalog is refreshed
+    """
+    data_path, root, files = _copy_test_data(n_files=1)
+    index_file = os.path.join(tempfile.mkdtemp(), 'catalog.json')
+
+    catalog = CCICatalog(root, index_file=index_file)
+    assert len(catalog) == 1
+    assert not catalog.refresh()
+
+    shutil.copy(os.path.join(data_path, "2016", files[1]),
+                os.path.join(root, "2016", files[1]))
+    # loading the stored catalog finds the new file
+    catalog = CCICatalog(root, index_file=index_file)
+    assert len(catalog) == 2
+
+    os.remove(os.path.join(root, "2016", files[0]))
+    assert catalog.refresh()
+    assert len(catalog) == 1
+    assert [e.path for e in catalog] == \
+           [os.path.join(root, "2016", files[1])]
+
+
+def test_CCI_SM_025Ds_with_catalog():
+    """
+    test reading images via the catalog
+    """
+    data_path, root, files = _copy_test_data()
+    index_file = os.path.join(tempfile.mkdtemp(), 'catalog.json')
+    grid = CCILandGrid()
+
+    ds = CCI_SM_025Ds(root, parameter=['sm'], subgrid=grid, array_1D=True)
+    ds_cat = CCI_SM_025Ds(root, parameter=['sm'], subgrid=grid, array_1D=True,
+                          catalog=CCICatalog(root, index_file=index_file))
+
+    tstamps = ds_cat.tstamps_for_daterange(datetime(2016, 6, 1),
+                                           datetime(2016, 6, 30))
+    assert len(tstamps) == len(files)
+    assert datetime(2016, 6, 7) in tstamps
+
+    img = ds.read(datetime(2016, 6, 7))
+    img_cat = ds_cat.read(datetime(2016, 6, 7))
+    nptest.assert_equal(img.data['sm'], img_cat.data['sm'])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+import numpy as np
+import numpy.testing as nptest
+import pandas as pd
+import pytest
+
+from esa_cci_sm.climatology import CCIClimatology, climatology, doy_index
+from esa_cci_sm.interface import CCITs
+from esa_cci_sm.reshuffle import reshuffle
+
+
+def test_doy_index():
+    """
+    test that dates get the same day of year index in all years
+    """
+    dates = np.array(['2015-02-28', '2015-03-01', '2016-02-29', '2016-03-01',
+                      '2016-12-31', '2017-01-01'], dtype='datetime64[ns]')
+    nptest.assert_equal(doy_index(dates), [58, 60, 59, 60, 365, 0])
+
+
+def test_climatology():
+    """
+    test the vectorized climatology against a loop over the days of year
+    """
+    dates = pd.date_range('2014-01-01', '2017-12-31').values
+    rng = np.random.default_rng(42)
+    data = rng.random((3, dates.size))
+    data[rng.random(data.shape) < 0.3] = np.nan
+
+    clim = climatology(data, dates, window_size=5, min_obs=1)
+    assert clim.shape == (3, 366)
+
+    doy = doy_index(dates)
+    for day in [0, 59, 200, 365]:
+        distance = np.abs(doy - day)
+        in_window = np.minimum(distance, 366 - distance) <= 2
+        nptest.assert_almost_equal(clim[:, day],
+                                   np.nanmean(data[:, in_window], axis=1))
+
+    assert np.all(np.isnan(climatology(data, dates, 5, min_obs=1000)))
+    clim_year = climatology(data, dates, window_size=365, min_obs=1)
+    nptest.assert_almost_equal(clim_year[:, 0], np.nanmean(data, axis=1), 2)
+    for window_size in [0, 4, 367]:
+        with pytest.raises(ValueError):
+            climatology(data, dates, window_size=window_size)
+
+
+def test_CCIClimatology(tmp_path):
+    """
+    test writing climatologies and anomalies of reshuffled time series
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "esa_cci_sm-test-data", "esa_cci_sm_dailyImages",
+                          "v05.2", "combined")
+    ts_path = str(tmp_path / "ts")
+    reshuffle(inpath, ts_path, datetime(2016, 6, 6), datetime(2016, 6, 8),
+              parameters=['sm'], ignore_meta=True, bbox=(-180, 65, -170, 70))
+
+    outputpath = str(tmp_path / "anomalies")
+    cells = CCIClimatology(ts_path, outputpath, min_obs=1).calc(workers=2)
+    nptest.assert_equal(cells, [31, 67])
+    assert sorted(os.listdir(outputpath)) == ['0031.nc', '0067.nc', 'grid.nc']
+
+    ds = CCITs(ts_path)
+    ds_anom = CCITs(outputpath)
+    for gpi in [914400, ds.grid.activegpis[-1]]:
+        sm = ds.read(gpi)['sm']
+        ts = ds_anom.read(gpi)
+        nptest.assert_equal(ts.index.values, sm.index.values)
+        # all three days are in the window of each other
+        nptest.assert_almost_equal(ts['sm_climatology'].values,
+                                   np.full(3, np.nanmean(sm.values)), 5)
+        nptest.assert_almost_equal(ts['sm_anomaly'].values,
+                                   sm.values - np.nanmean(sm.values), 5)
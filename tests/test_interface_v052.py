@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
 from datetime import datetime
-from esa_cci_sm.interface import CCI_SM_025Ds, CCI_SM_025Img
-from esa_cci_sm.grid import CCILandGrid
+from esa_cci_sm.interface import CCI_SM_025Ds, CCI_SM_025Img, get_read_plan, \
+    date_range
+from esa_cci_sm.grid import CCILandGrid, CCICellGrid
 import numpy as np
 import numpy.testing as nptest
 
@@ -94,6 +95,88 @@ def test_CCI_SM_v052_025Ds_timestamps_for_daterange():
                          datetime(2016, 6, 8, 0)]
 
 
+def test_CCI_SM_v052_025Ds_timestamps_only_available():
+    """
+    test that dates without files are skipped if requested
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "active")
+    ds = CCI_SM_025Ds(data_path=data_path, parameter='sm', only_available=True)
+
+    tstamps = ds.tstamps_for_daterange(datetime(2016, 6, 1),
+                                       datetime(2016, 6, 7))
+    assert datetime(2016, 6, 1) not in tstamps
+    assert tstamps[-2:] == [datetime(2016, 6, 6), datetime(2016, 6, 7)]
+
+    tstamps = ds.tstamps_for_daterange(datetime(2016, 6, 1),
+                                       datetime(2016, 6, 7),
+                                       only_available=False)
+    assert len(tstamps) == 7
+
+
+def test_date_range_resolutions():
+    """
+    test creating daily, dekadal and monthly date ranges
+    """
+    dates = date_range(datetime(2016, 1, 30, 12), datetime(2016, 2, 2, 12))
+    assert dates.astype(datetime).tolist() == \
+           [datetime(2016, 1, 30, 12), datetime(2016, 1, 31, 12),
+            datetime(2016, 2, 1, 12), datetime(2016, 2, 2, 12)]
+
+    dates = date_range(datetime(2016, 1, 5), datetime(2016, 3, 1), 'dekadal')
+    assert dates.astype(datetime).tolist() == \
+           [datetime(2016, 1, 11), datetime(2016, 1, 21), datetime(2016, 2, 1),
+            datetime(2016, 2, 11), datetime(2016, 2, 21), datetime(2016, 3, 1)]
+
+    dates = date_range(datetime(2015, 12, 1), datetime(2016, 2, 15), 'monthly')
+    assert dates.astype(datetime).tolist() == \
+           [datetime(2015, 12, 1), datetime(2016, 1, 1), datetime(2016, 2, 1)]
+
+
+def test_CCI_SM_v052_025Ds_read_stack():
+    """
+    test reading a stack of images into preallocated arrays
+    """
+    parameter = ['sm', 'flag']
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "combined")
+    land_grid = CCILandGrid()
+    ds = CCI_SM_025Ds(data_path=data_path, parameter=parameter,
+                      subgrid=land_grid, array_1D=True)
+
+    # the day before is not available and skipped
+    dates = [datetime(2016, 6, 6), datetime(2016, 6, 7), datetime(2016, 6, 8)]
+    with nptest.suppress_warnings() as sup:
+        sup.filter(UserWarning)
+        stack, timestamps = ds.read_stack([datetime(2016, 6, 5)] + dates)
+
+    assert timestamps == dates
+    assert stack['sm'].shape == (3, land_grid.activegpis.size)
+    assert stack['flag'].dtype == np.int8
+    for i, date in enumerate(dates):
+        image = ds.read(date)
+        nptest.assert_equal(stack['sm'][i], image.data['sm'])
+        nptest.assert_equal(stack['flag'][i], image.data['flag'])
+
+    # pooled arrays are reused
+    stack2, _ = ds.read_stack(dates[:2])
+    assert np.shares_memory(stack['sm'], stack2['sm'])
+    ds.release_stack_buffers()
+    stack4, _ = ds.read_stack(dates[1:])
+    assert not np.shares_memory(stack2['sm'], stack4['sm'])
+
+    # caller supplied arrays
+    out = {'sm': np.full((5, land_grid.activegpis.size), -1, np.float32)}
+    ds = CCI_SM_025Ds(data_path=data_path, parameter='sm',
+                      subgrid=land_grid, array_1D=True)
+    stack3, timestamps = ds.read_stack(dates[1:], out=out)
+    assert stack3['sm'].base is out['sm']
+    assert timestamps == dates[1:]
+    for i, date in enumerate(timestamps):
+        nptest.assert_equal(out['sm'][i], ds.read(date).data['sm'])
+    assert np.all(out['sm'][2:] == -1)
+
+
 def test_CCI_SM_v052_025Img_img_reading_1D_combined():
     """
     1D test for the read function of the CCI_SM_image class
@@ -226,6 +309,89 @@ def test_CCI_SM_v052_025Img_img_reading_1D_passive():
     assert ref_lon == lon
     nptest.assert_almost_equal(ref_sm, sm, 5)
 
+def test_CCI_SM_v052_025Img_img_reading_1D_windowed():
+    """
+    Windowed reading of a regional subgrid must give the same result as
+    reading the global image.
+    """
+    parameter = ['sm', 'sm_uncertainty', 'flag']
+    filename = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+               "esa_cci_sm_dailyImages", "v05.2", "combined", "2016",
+               "ESACCI-SOILMOISTURE-L3S-SSMV-COMBINED-20160607000000-fv05.2.nc")
+
+    subgrid = CCILandGrid().subgrid_from_bbox(min_lon=70., min_lat=10.,
+                                             max_lon=80., max_lat=20.)
+
+    img_full = CCI_SM_025Img(filename=filename, parameter=parameter,
+                             subgrid=subgrid, array_1D=True).read()
+    reader = CCI_SM_025Img(filename=filename, parameter=parameter,
+                           subgrid=subgrid, array_1D=True, windowed=True)
+    img_wind = reader.read()
+
+    assert img_wind.data['sm'].size == subgrid.activegpis.size
+    nptest.assert_equal(img_wind.lat, img_full.lat)
+    nptest.assert_equal(img_wind.lon, img_full.lon)
+    for p in parameter:
+        nptest.assert_equal(img_wind.data[p], img_full.data[p])
+
+    assert reader.grid.find_nearest_gpi(75.625, 14.625) == (602942, 0)
+    idx = np.where(subgrid.activegpis == 602942)[0][0]
+    nptest.assert_almost_equal(img_wind.data['sm'][idx],
+                               img_full.data['sm'][idx], 5)
+
+
+def test_CCI_SM_v052_025Img_quality_filter():
+    """
+    Soil moisture must be masked by flag and uncertainty while reading.
+    """
+    filename = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+               "esa_cci_sm_dailyImages", "v05.2", "combined", "2016",
+               "ESACCI-SOILMOISTURE-L3S-SSMV-COMBINED-20160607000000-fv05.2.nc")
+
+    img = CCI_SM_025Img(filename=filename,
+                        parameter=['sm', 'sm_uncertainty', 'flag'],
+                        array_1D=True).read()
+    img_qc = CCI_SM_025Img(filename=filename, parameter='sm',
+                           array_1D=True).read(flags_allowed=1,
+                                               max_uncertainty=0.05)
+
+    assert sorted(img_qc.data.keys()) == ['sm']
+    good = ((img.data['flag'] & ~1) == 0) & \
+        (img.data['sm_uncertainty'] <= 0.05)
+    assert 0 < good.sum() < good.size
+    expected = np.where(good, img.data['sm'], np.nan)
+    nptest.assert_equal(img_qc.data['sm'], expected)
+
+
+def test_read_plan_gather():
+    """
+    The read plan must give the same result as flipping, flattening and
+    sub-setting the image.
+    """
+    data = np.ma.masked_array(np.random.rand(720, 1440).astype(np.float32))
+    data[10, 20] = np.ma.masked
+    should = np.flipud(data).filled(np.nan).flatten()
+
+    land_grid = CCILandGrid()
+    plan = get_read_plan(land_grid, (720, 1440), array_1D=True)
+    assert get_read_plan(land_grid, (720, 1440), array_1D=True) is plan
+    nptest.assert_equal(plan.gather(data[plan.rows, plan.cols]),
+                        should[land_grid.activegpis])
+
+    plan = get_read_plan(land_grid, (720, 1440), windowed=True, array_1D=True)
+    out = np.empty(land_grid.activegpis.size, dtype=np.float32)
+    plan.gather(data[plan.rows, plan.cols], out=out)
+    nptest.assert_equal(out, should[land_grid.activegpis])
+
+    # global 2D images can be used as they are
+    plan = get_read_plan(CCICellGrid(), (720, 1440), array_1D=False)
+    assert plan.index is None
+    values = plan.gather(data.copy())
+    assert values.shape == (720, 1440)
+    assert np.isnan(values[10, 20])
+    nptest.assert_equal(values, data.filled(np.nan))
+
+
 def test_CCI_SM_v052_025Img_img_reading_2D():
     """
     2D test for the read function of the CCI_SM_image class
@@ -289,6 +455,27 @@ def test_CCI_SM_v052_025Img_img_reading_2D():
     assert image_p.lon.shape == image_p.lat.shape == (720, 1440)
 
 
+def test_CCI_SM_v052_025Ds_iter_images_prefetch():
+    """
+    test that prefetched images are the same and in the same order
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                "esa_cci_sm_dailyImages", "v05.2", "combined")
+    ds = CCI_SM_025Ds(data_path=data_path, parameter=['sm', 'flag'],
+                      subgrid=CCILandGrid(), array_1D=True)
+    start, end = datetime(2016, 6, 6), datetime(2016, 6, 8)
+
+    images = list(ds.iter_images(start, end))
+    images_pre = list(ds.iter_images(start, end, prefetch=2, workers=2))
+
+    assert len(images) == len(images_pre) == 3
+    for img, img_pre in zip(images, images_pre):
+        assert img.timestamp == img_pre.timestamp
+        nptest.assert_equal(img.lon, img_pre.lon)
+        for param in ['sm', 'flag']:
+            nptest.assert_equal(img.data[param], img_pre.data[param])
+            nptest.assert_equal(img.metadata[param], img_pre.metadata[param])
+
 
 if __name__ == '__main__':
     test_CCI_SM_v052_025Ds_img_reading()
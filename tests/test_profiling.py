@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+from esa_cci_sm.profiling import Profiler, profiled
+from esa_cci_sm.interface import CCI_SM_025Ds
+
+
+def test_profiler():
+    """
+    test collecting and merging stage timings and counters
+    """
+    profiler = Profiler()
+    with profiler.stage('read'):
+        pass
+    with profiled(profiler, 'read'):
+        profiler.count('images')
+    with profiled(None, 'read'):
+        pass
+    profiler.count('bytes_read', 100)
+
+    report = profiler.report()
+    assert report['stages']['read']['calls'] == 2
+    assert report['counters'] == {'images': 1, 'bytes_read': 100}
+    assert report['peak_memory'] > 0
+
+    other = Profiler()
+    other.merge(report)
+    other.merge(report)
+    assert other.report()['stages']['read']['calls'] == 4
+    assert other.counters == {'images': 2, 'bytes_read': 200}
+    assert 'images 2' in other.summary()
+
+
+def test_CCI_SM_025Ds_profiler():
+    """
+    test profiling image reading
+    """
+    data_path = os.path.join(os.path.dirname(__file__), "esa_cci_sm-test-data",
+                             "esa_cci_sm_dailyImages", "v05.2", "combined")
+    profiler = Profiler()
+    ds = CCI_SM_025Ds(data_path, parameter=['sm', 'flag'], profiler=profiler)
+    ds.read(datetime(2016, 6, 7))
+
+    assert set(profiler.stages.keys()) == {'search', 'open', 'read', 'gather'}
+    assert profiler.stages['read'][1] == 2
+    assert profiler.counters['images'] == 1
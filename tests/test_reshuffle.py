@@ -1,11 +1,17 @@
 import os
 import glob
+import json
+import shutil
 import tempfile
+from datetime import datetime
 import numpy as np
 import numpy.testing as nptest
+import pytest
 
-from esa_cci_sm.reshuffle import main
-from esa_cci_sm.interface import CCITs
+from esa_cci_sm.reshuffle import main, estimate_imgbuffer, parse_size, \
+    current_rss
+from esa_cci_sm.interface import CCITs, CCI_SM_025Ds
+from esa_cci_sm.grid import CCILandGrid
 
 from netCDF4 import Dataset
 
@@ -117,5 +123,497 @@ def test_reshuffle_v033():
     assert ds.variables['sm'].getncattr('long_name') == u'Volumetric Soil Moisture'
     assert ds.variables['sm'].getncattr('units') == u'm3 m-3'
 
+
+def test_reshuffle_v052_workers():
+    """
+    test that reshuffling with multiple processes gives the same time series
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    startdate = "2016-06-06T00:00"
+    enddate = "2016-06-08T00:00"
+    args = ["--parameters", "sm", "flag", "--land_points", "True"]
+
+    ts_path = tempfile.mkdtemp()
+    main([inpath, ts_path, startdate, enddate] + args)
+    ts_path_workers = tempfile.mkdtemp()
+    main([inpath, ts_path_workers, startdate, enddate] + args + ["--workers", "3"])
+
+    files = sorted(os.listdir(ts_path))
+    assert sorted(os.listdir(ts_path_workers)) == files
+    assert not glob.glob(os.path.join(ts_path_workers, ".reshuffle_journal*"))
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_workers = CCITs(ts_path_workers, ioclass_kws={'read_bulk': True})
+    nptest.assert_equal(np.sort(ds.grid.activegpis),
+                        np.sort(ds_workers.grid.activegpis))
+    for gpi in [914400, 911520, ds.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_workers = ds_workers.read(gpi)
+        nptest.assert_equal(ts.index.values, ts_workers.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_workers['sm'].values)
+        nptest.assert_equal(ts['flag'].values, ts_workers['flag'].values)
+
+
+def test_reshuffle_v052_append():
+    """
+    test extending existing time series with new images
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = ["--parameters", "sm", "--land_points", "True", "--ignore_meta", "False"]
+
+    ts_path = tempfile.mkdtemp()
+    main([inpath, ts_path, "2016-06-06", "2016-06-08"] + args)
+    ts_path_append = tempfile.mkdtemp()
+    main([inpath, ts_path_append, "2016-06-06", "2016-06-06"] + args)
+    main([inpath, ts_path_append, "2016-06-06", "2016-06-08"] + args +
+         ["--append", "True"])
+    # nothing is added when the time series are up to date
+    with pytest.warns(UserWarning, match="nothing to append"):
+        main([inpath, ts_path_append, "2016-06-06", "2016-06-08"] + args +
+             ["--append", "True"])
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_append = CCITs(ts_path_append, ioclass_kws={'read_bulk': True})
+    for gpi in [914400, ds.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_append = ds_append.read(gpi)
+        assert len(ts_append.index) == 3
+        nptest.assert_equal(ts.index.values, ts_append.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_append['sm'].values)
+
+    with Dataset(os.path.join(ts_path_append, '2244.nc')) as ds:
+        assert ds.getncattr('time_coverage_start') == '2016-06-06 00:00:00'
+        assert ds.getncattr('time_coverage_end') == '2016-06-08 00:00:00'
+
+
+def test_reshuffle_v052_resume():
+    """
+    test continuing an interrupted reshuffle, with cells that were written
+    after the last checkpoint, corrupt and missing cells
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = ["--parameters", "sm", "--land_points", "True"]
+
+    ts_path = tempfile.mkdtemp()
+    main([inpath, ts_path, "2016-06-06", "2016-06-08"] + args)
+    assert not glob.glob(os.path.join(ts_path, ".reshuffle_journal*"))
+
+    # state of a run that was interrupted after the first image was written
+    ts_path_resume = tempfile.mkdtemp()
+    main([inpath, ts_path_resume, "2016-06-06", "2016-06-07"] + args)
+    cells = np.unique(CCILandGrid().activearrcell).tolist()
+    with open(os.path.join(ts_path_resume, ".reshuffle_journal_0.json"), 'w') as f:
+        json.dump({'startdate': '2016-06-06T00:00:00', 'parameters': ['sm'],
+                   'cells': cells, 'done_until': '2016-06-06T00:00:00'}, f)
+    with open(os.path.join(ts_path_resume, "2244.nc"), 'wb') as f:
+        f.write(b'corrupt')
+    os.remove(os.path.join(ts_path_resume, "0031.nc"))
+
+    main([inpath, ts_path_resume, "2016-06-06", "2016-06-08"] + args +
+         ["--resume", "True"])
+    assert not glob.glob(os.path.join(ts_path_resume, ".reshuffle_journal*"))
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_resume = CCITs(ts_path_resume, ioclass_kws={'read_bulk': True})
+    gpis = [914400, ds.grid.grid_points_for_cell(2244)[0][0],
+            ds.grid.activegpis[-1]]
+    for gpi in gpis:
+        ts = ds.read(gpi)
+        ts_resume = ds_resume.read(gpi)
+        assert len(ts_resume.index) == 3
+        nptest.assert_equal(ts.index.values, ts_resume.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_resume['sm'].values)
+
+
+def test_reshuffle_v052_resume_workers():
+    """
+    test continuing an interrupted reshuffle of several products with several
+    workers, products that all groups had finished must not be converted again
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2")
+    products = ['active', 'combined']
+    args = ["2016-06-06", "2016-06-08", "--parameters", "sm", "--land_points",
+            "True", "--bbox", "-180", "65", "-170", "70", "--workers", "2"]
+
+    ts_root = tempfile.mkdtemp()
+    main([os.path.join(root, p) for p in products] + [ts_root] + args)
+
+    # the sm variable of the last combined image has no time dimension, so
+    # the run fails after the active product was finished by all groups
+    input_root = tempfile.mkdtemp()
+    inputs = [os.path.join(input_root, p) for p in products]
+    for product, path in zip(products, inputs):
+        shutil.copytree(os.path.join(root, product), path)
+    last_image = os.path.join(
+        inputs[1], "2016",
+        "ESACCI-SOILMOISTURE-L3S-SSMV-COMBINED-20160608000000-fv05.2.nc")
+    shutil.move(last_image, last_image + ".bak")
+    with Dataset(last_image, 'w') as ds:
+        ds.createDimension('lat', 720)
+        ds.createDimension('lon', 1440)
+        ds.createVariable('sm', 'f4', ('lat', 'lon'))
+
+    ts_root_resume = tempfile.mkdtemp()
+    with pytest.raises(Exception):
+        main(inputs + [ts_root_resume] + args)
+    for product in products:
+        journals = glob.glob(os.path.join(ts_root_resume, product,
+                                          ".reshuffle_journal*"))
+        assert len(journals) == 2
+    for journal in glob.glob(os.path.join(ts_root_resume, "active",
+                                          ".reshuffle_journal*")):
+        with open(journal) as f:
+            assert json.load(f)['finished']
+
+    shutil.move(last_image + ".bak", last_image)
+    main(inputs + [ts_root_resume] + args + ["--resume", "True"])
+
+    for product in products:
+        path = os.path.join(ts_root_resume, product)
+        assert not glob.glob(os.path.join(path, ".reshuffle_journal*"))
+        ds = CCITs(os.path.join(ts_root, product))
+        ds_resume = CCITs(path)
+        for gpi in [914400, ds.grid.activegpis[-1]]:
+            ts = ds.read(gpi)
+            ts_resume = ds_resume.read(gpi)
+            # no time stamps are added twice
+            assert len(ts_resume.index) == 3
+            nptest.assert_equal(ts.index.values, ts_resume.index.values)
+            nptest.assert_equal(ts['sm'].values, ts_resume['sm'].values)
+
+
+def test_estimate_imgbuffer():
+    """
+    test deriving the number of images to read at once from a memory limit
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    grid = CCILandGrid()
+    ds = CCI_SM_025Ds(inpath, parameter=['sm', 'flag'], subgrid=grid,
+                      array_1D=True)
+    timestamps = [datetime(2016, 6, 6), datetime(2016, 6, 7),
+                  datetime(2016, 6, 8)]
+    # float32 sm and int8 flag, copied once when sorting by cell
+    image_size = 2 * 5 * grid.activegpis.size
+
+    assert estimate_imgbuffer(ds, timestamps, 0) == 1
+    assert estimate_imgbuffer(ds, timestamps, 2**40) == 3
+    assert estimate_imgbuffer(ds, timestamps * 10,
+                              current_rss() + 5.5 * image_size) == 5
+
+    assert parse_size('16GB') == 16 * 2**30
+    assert parse_size('500M') == 500 * 2**20
+    assert parse_size('1e9') == 10**9
+
+
+def test_reshuffle_v052_memory_limit():
+    """
+    test that reshuffling with a (too low) memory limit gives the same results
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = [inpath, None, "2016-06-06", "2016-06-08",
+            "--parameters", "sm", "--land_points", "True"]
+
+    ts_path = tempfile.mkdtemp()
+    main([a if a else ts_path for a in args])
+    ts_path_limit = tempfile.mkdtemp()
+    main([a if a else ts_path_limit for a in args] + ["--memory-limit", "1MB"])
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_limit = CCITs(ts_path_limit, ioclass_kws={'read_bulk': True})
+    ts = ds.read(914400)
+    ts_limit = ds_limit.read(914400)
+    assert len(ts_limit.index) == 3
+    nptest.assert_equal(ts['sm'].values, ts_limit['sm'].values)
+
+
+def test_reshuffle_v052_staging():
+    """
+    test that the staging engine writes the same time series
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = [inpath, None, "2016-06-06", "2016-06-08", "--parameters", "sm",
+            "flag", "--land_points", "True", "--ignore_meta", "False",
+            "--imgbuffer", "2"]
+
+    ts_path = tempfile.mkdtemp()
+    main([a if a else ts_path for a in args])
+    ts_path_staging = tempfile.mkdtemp()
+    staging_dir = tempfile.mkdtemp()
+    main([a if a else ts_path_staging for a in args] +
+         ["--engine", "staging", "--staging_dir", staging_dir])
+    assert os.listdir(staging_dir) == []
+    files = [os.path.basename(f) for f in glob.glob(os.path.join(ts_path, "*.nc"))]
+    assert all(os.path.isfile(os.path.join(ts_path_staging, f)) for f in files)
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_staging = CCITs(ts_path_staging, ioclass_kws={'read_bulk': True})
+    for gpi in [914400, ds.grid.activegpis[0], ds.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_staging = ds_staging.read(gpi)
+        nptest.assert_equal(ts.index.values, ts_staging.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_staging['sm'].values)
+        nptest.assert_equal(ts['flag'].values, ts_staging['flag'].values)
+
+    with Dataset(os.path.join(ts_path, '2244.nc')) as nc, \
+            Dataset(os.path.join(ts_path_staging, '2244.nc')) as nc_staging:
+        nptest.assert_equal(nc.variables['location_id'][:],
+                            nc_staging.variables['location_id'][:])
+        for attr in ['time_coverage_start', 'time_coverage_end', 'title']:
+            assert nc.getncattr(attr) == nc_staging.getncattr(attr)
+        assert nc.variables['sm'].getncattr('units') == \
+               nc_staging.variables['sm'].getncattr('units')
+
+
+def test_reshuffle_v052_encoding():
+    """
+    test compression, chunking and quantization settings of the time series
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    ts_path = tempfile.mkdtemp()
+    args = [inpath, ts_path, "2016-06-06", "2016-06-08",
+            "--parameters", "sm", "flag", "--land_points", "True",
+            "--complevel", "6", "--shuffle", "False",
+            "--chunksizes", "sm=1,100", "--least_significant_digit", "sm=2"]
+    main(args)
+
+    with Dataset(os.path.join(ts_path, '2244.nc')) as ds:
+        sm, flag = ds.variables['sm'], ds.variables['flag']
+        assert sm.filters()['complevel'] == 6
+        assert not sm.filters()['shuffle']
+        assert sm.chunking() == [1, 100]
+        assert flag.chunking() == [ds.dimensions['locations'].size, 1000]
+        assert flag.filters()['complevel'] == 6
+        values = sm[:].compressed()
+        # quantized to a precision of 2 digits
+        nptest.assert_allclose(values, np.round(values, 2), atol=2**-7)
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    assert len(ds.read(914400).index) == 3
+
+
+def test_reshuffle_v052_pack():
+    """
+    test storing packed int16 time series, that are unpacked when reading
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = [inpath, None, "2016-06-06", "2016-06-08", "--parameters", "sm",
+            "sm_uncertainty", "flag", "--land_points", "True",
+            "--ignore_meta", "False"]
+
+    ts_path = tempfile.mkdtemp()
+    main([a if a else ts_path for a in args])
+    ts_path_pack = tempfile.mkdtemp()
+    main([a if a else ts_path_pack for a in args] + ["--pack", "True"])
+
+    with Dataset(os.path.join(ts_path_pack, '2244.nc')) as ds:
+        sm = ds.variables['sm']
+        assert sm.dtype == np.int16
+        assert sm.scale_factor.dtype == np.float32
+        nptest.assert_equal(sm.valid_range, [-32767, 32767])
+        assert ds.variables['sm_uncertainty'].dtype == np.int16
+        assert ds.variables['flag'].dtype == np.int8
+    assert os.path.getsize(os.path.join(ts_path_pack, '2244.nc')) < \
+           os.path.getsize(os.path.join(ts_path, '2244.nc'))
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_pack = CCITs(ts_path_pack, ioclass_kws={'read_bulk': True})
+    for gpi in [914400, ds.grid.activegpis[0], ds.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_pack = ds_pack.read(gpi)
+        assert ts_pack['sm'].dtype == np.float32
+        nptest.assert_equal(np.isnan(ts['sm'].values),
+                            np.isnan(ts_pack['sm'].values))
+        nptest.assert_allclose(ts_pack['sm'].values, ts['sm'].values,
+                               atol=1. / 65534)
+        nptest.assert_equal(ts['flag'].values, ts_pack['flag'].values)
+
+    # explicit packing parameters
+    ts_path_pack = tempfile.mkdtemp()
+    main([a if a else ts_path_pack for a in args] + ["--pack", "sm=0.0001,0"])
+    with Dataset(os.path.join(ts_path_pack, '2244.nc')) as ds:
+        assert ds.variables['sm'].dtype == np.int16
+        assert ds.variables['sm'].scale_factor == np.float32(0.0001)
+        assert ds.variables['sm_uncertainty'].dtype == np.float32
+
+
+def test_reshuffle_v052_pipelined():
+    """
+    test that reading and writing in parallel gives the same time series
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = [inpath, None, "2016-06-06", "2016-06-08", "--parameters", "sm",
+            "flag", "--land_points", "True", "--imgbuffer", "2"]
+
+    ts_path = tempfile.mkdtemp()
+    main([a if a else ts_path for a in args])
+    ts_path_pipe = tempfile.mkdtemp()
+    main([a if a else ts_path_pipe for a in args] + ["--pipelined", "True"])
+
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    ds_pipe = CCITs(ts_path_pipe, ioclass_kws={'read_bulk': True})
+    for gpi in [914400, ds.grid.activegpis[0], ds.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_pipe = ds_pipe.read(gpi)
+        assert len(ts_pipe.index) == 3
+        nptest.assert_equal(ts.index.values, ts_pipe.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_pipe['sm'].values)
+        nptest.assert_equal(ts['flag'].values, ts_pipe['flag'].values)
+
+
+def test_reshuffle_v052_profile_report():
+    """
+    test that the profile report contains the stages of reading and writing
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    ts_path = tempfile.mkdtemp()
+    report_file = os.path.join(tempfile.mkdtemp(), 'profile.json')
+    args = [inpath, ts_path, "2016-06-06", "2016-06-08", "--parameters", "sm",
+            "--land_points", "True", "--profile-report", report_file]
+    main(args)
+
+    with open(report_file) as f:
+        report = json.load(f)
+
+    for stage in ['search', 'open', 'read', 'gather', 'write']:
+        assert report['stages'][stage]['calls'] > 0
+    assert report['counters']['images'] == 3
+    assert report['counters']['bytes_read'] == 3 * 720 * 1440 * 4
+    assert report['counters']['bytes_written'] > 0
+    assert report['peak_memory'] > 0
+    assert report['wall_time'] > 0
+
+
+def test_reshuffle_v052_region():
+    """
+    test reshuffling only the points in a bounding box, cells or mask
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2", "combined")
+    args = [inpath, None, "2016-06-06", "2016-06-08", "--parameters", "sm",
+            "--land_points", "True"]
+
+    ts_path = tempfile.mkdtemp()
+    main([a if a else ts_path for a in args] + ["--cells", "31", "67"])
+    ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+
+    # points in the bounding box in cells 31 and 67
+    ts_path_bbox = tempfile.mkdtemp()
+    main([a if a else ts_path_bbox for a in args] +
+         ["--bbox", "-180", "65", "-170", "70", "--workers", "2"])
+    ds_bbox = CCITs(ts_path_bbox, ioclass_kws={'read_bulk': True})
+    assert sorted(glob.glob(os.path.join(ts_path_bbox, '*.nc'))) == \
+        [os.path.join(ts_path_bbox, f) for f in ['0031.nc', '0067.nc', 'grid.nc']]
+    lons, lats = ds_bbox.grid.activearrlon, ds_bbox.grid.activearrlat
+    assert (lons.min() >= -180) and (lons.max() <= -170)
+    assert (lats.min() >= 65) and (lats.max() <= 70)
+
+    # one point selected in a mask file
+    mask_file = os.path.join(tempfile.mkdtemp(), 'mask.nc')
+    with Dataset(mask_file, 'w') as mask_ds:
+        mask_ds.createDimension('lat', 4)
+        mask_ds.createDimension('lon', 4)
+        mask_ds.createVariable('lat', 'f4', ('lat',))[:] = \
+            [69.375, 69.125, 68.875, 68.625]
+        mask_ds.createVariable('lon', 'f4', ('lon',))[:] = \
+            [-179.875, -179.625, -179.375, -179.125]
+        mask = np.zeros((4, 4), dtype='i1')
+        mask[2, 0] = 1
+        mask_ds.createVariable('region', 'i1', ('lat', 'lon'))[:] = mask
+    ts_path_mask = tempfile.mkdtemp()
+    main([a if a else ts_path_mask for a in args] + ["--mask-file", mask_file])
+    ds_mask = CCITs(ts_path_mask, ioclass_kws={'read_bulk': True})
+    nptest.assert_equal(ds_mask.grid.activegpis, [914400])
+
+    for gpi in [914400, ds_bbox.grid.activegpis[0], ds_bbox.grid.activegpis[-1]]:
+        ts = ds.read(gpi)
+        ts_bbox = ds_bbox.read(gpi)
+        nptest.assert_equal(ts.index.values, ts_bbox.index.values)
+        nptest.assert_equal(ts['sm'].values, ts_bbox['sm'].values)
+    nptest.assert_equal(ds.read(914400)['sm'].values,
+                        ds_mask.read(914400)['sm'].values)
+
+
+def test_reshuffle_v052_products():
+    """
+    test converting several products in one run
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2")
+    products = ['active', 'passive', 'combined']
+    args = ["2016-06-06", "2016-06-08", "--parameters", "sm", "--land_points",
+            "True", "--bbox", "-180", "65", "-170", "70"]
+
+    ts_root = tempfile.mkdtemp()
+    main([os.path.join(root, p) for p in products] + [ts_root] + args +
+         ["--workers", "2"])
+    ts_root_single = tempfile.mkdtemp()
+    main([os.path.join(root, p) for p in products] + [ts_root_single] + args)
+    assert sorted(os.listdir(ts_root)) == sorted(products)
+
+    for product in products:
+        ts_path = tempfile.mkdtemp()
+        main([os.path.join(root, product), ts_path] + args)
+        ds = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+        ds_multi = CCITs(os.path.join(ts_root, product),
+                         ioclass_kws={'read_bulk': True})
+        ds_single = CCITs(os.path.join(ts_root_single, product),
+                          ioclass_kws={'read_bulk': True})
+        for gpi in [914400, ds.grid.activegpis[-1]]:
+            ts = ds.read(gpi)
+            assert len(ts.index) == 3
+            nptest.assert_equal(ts['sm'].values, ds_multi.read(gpi)['sm'].values)
+            nptest.assert_equal(ts['sm'].values, ds_single.read(gpi)['sm'].values)
+
+
+def test_reshuffle_v052_products_catalog():
+    """
+    test converting several products in one run with a catalog of each
+    input root from the command line
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "esa_cci_sm-test-data", "esa_cci_sm_dailyImages", "v05.2")
+    products = ['active', 'combined']
+    args = ["2016-06-06", "2016-06-08", "--parameters", "sm", "--land_points",
+            "True", "--bbox", "-180", "65", "-170", "70"]
+
+    # the catalogs are stored in the input roots
+    input_root = tempfile.mkdtemp()
+    inputs = [os.path.join(input_root, p) for p in products]
+    for product, path in zip(products, inputs):
+        shutil.copytree(os.path.join(root, product), path)
+
+    ts_root = tempfile.mkdtemp()
+    main(inputs + [ts_root] + args + ["--catalog"])
+    for path in inputs:
+        assert os.path.isfile(os.path.join(path, '.esa_cci_sm_catalog.json'))
+
+    ts_root_true = tempfile.mkdtemp()
+    main(inputs + [ts_root_true] + args + ["--catalog", "True"])
+    assert not os.path.exists("True")
+
+    for product, path in zip(products, inputs):
+        ts_path = tempfile.mkdtemp()
+        main([os.path.join(root, product), ts_path] + args)
+        ds = CCITs(ts_path)
+        for ts_dir in [ts_root, ts_root_true]:
+            ds_catalog = CCITs(os.path.join(ts_dir, product))
+            for gpi in [914400, ds.grid.activegpis[-1]]:
+                ts = ds.read(gpi)
+                assert len(ts.index) == 3
+                nptest.assert_equal(ts['sm'].values,
+                                    ds_catalog.read(gpi)['sm'].values)
+
+
 if __name__ == '__main__':
-    test_reshuffle_v033()
\ No newline at end of file
+    test_reshuffle_v033()
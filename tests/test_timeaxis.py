@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import numpy.testing as nptest
+import pytest
+from netCDF4 import num2date
+
+from esa_cci_sm.timeaxis import decode_time
+
+
+@pytest.mark.parametrize("units", ["days since 1970-01-01 00:00:00",
+                                   "hours since 1900-01-01",
+                                   "seconds since 2000-01-01T00:00:00Z"])
+def test_decode_time(units):
+    """
+    test vectorized conversion of time stamps against num2date
+    """
+    values = np.arange(10000., 12000.) + 0.25
+    dates = decode_time(values, units)
+    expected = num2date(values, units, only_use_cftime_datetimes=False,
+                        only_use_python_datetimes=True)
+    assert dates.dtype == np.dtype('datetime64[ns]')
+    nptest.assert_equal(dates, np.asarray(expected).astype('datetime64[ns]'))
+
+    nptest.assert_equal(decode_time(values.astype(np.int32), units),
+                        decode_time(np.floor(values), units))
+
+
+def test_decode_time_cache():
+    """
+    test that equal time axes share the decoded time stamps
+    """
+    values = np.arange(15000., 15100.)
+    dates = decode_time(values, "days since 1970-01-01")
+    assert decode_time(values.copy(), "days since 1970-01-01") is dates
+    assert decode_time(values, "days since 1970-01-02") is not dates
+    assert not dates.flags.writeable
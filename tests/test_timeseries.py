@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+import numpy as np
+import numpy.testing as nptest
+import pytest
+from netCDF4 import Dataset
+
+from esa_cci_sm.interface import CCITs
+from esa_cci_sm.reshuffle import reshuffle
+
+@pytest.fixture(scope="module")
+def ts_path(tmp_path_factory):
+    """
+    Reshuffle the test images of a small region (cells 31 and 67) once for
+    all tests in this module.
+    """
+    inpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "esa_cci_sm-test-data", "esa_cci_sm_dailyImages",
+                          "v05.2", "combined")
+    path = str(tmp_path_factory.mktemp("ts"))
+    reshuffle(inpath, path, datetime(2016, 6, 6), datetime(2016, 6, 8),
+              parameters=['sm', 'sm_uncertainty', 'flag'], ignore_meta=True,
+              bbox=(-180, 65, -170, 70))
+    return path
+
+
+def _sm_stats(data, dates):
+    """
+    Per location statistics for test_CCITs_map_cells.
+    """
+    return {'sm_mean': np.nanmean(data['sm'], axis=1),
+            'n_obs': np.sum(np.isfinite(data['sm']), axis=1)}
+
+
+def test_CCITs_read_many(ts_path):
+    """
+    test reading many locations at once
+    """
+    ds = CCITs(ts_path)
+    gpis = np.array([914400, ds.grid.activegpis[-1], ds.grid.activegpis[0],
+                     914401])
+    assert len(np.unique(ds.grid.gpi2cell(gpis))) == 2
+    ds.read(gpis[0])
+    dates = ds.dates
+    ds.read(gpis[1])
+    assert ds.dates is dates  # same time axis in both cell files
+
+    data, read_gpis, dates = ds.read_many(gpis, parameters=['sm', 'flag'])
+    nptest.assert_equal(read_gpis, gpis)
+    assert data['sm'].shape == data['flag'].shape == (4, 3)
+    for i, gpi in enumerate(gpis):
+        ts = ds.read(gpi)
+        nptest.assert_equal(dates, ts.index.values)
+        nptest.assert_equal(data['sm'][i], ts['sm'].values)
+        nptest.assert_equal(data['flag'][i], ts['flag'].values)
+
+    lon, lat = ds.grid.gpi2lonlat(gpis)
+    data_lonlat, read_gpis, _ = ds.read_many(lon=lon, lat=lat,
+                                             period=(datetime(2016, 6, 7),
+                                                     datetime(2016, 6, 8)))
+    nptest.assert_equal(read_gpis, gpis)
+    nptest.assert_equal(data_lonlat['sm'], data['sm'][:, 1:])
+
+    ds_bulk = CCITs(ts_path, ioclass_kws={'read_bulk': True})
+    dataset = ds_bulk.read_many(gpis, parameters='sm', as_xarray=True)
+    nptest.assert_equal(dataset['sm'].values, data['sm'])
+    nptest.assert_equal(dataset['gpi'].values, gpis)
+
+
+def test_CCITs_read_time_window(ts_path):
+    """
+    test reading only a period of the time series
+    """
+    for read_bulk in [False, True]:
+        ds = CCITs(ts_path, ioclass_kws={'read_bulk': read_bulk})
+        ts = ds.read(914400)
+
+        ts_window = ds.read(914400, start=datetime(2016, 6, 7),
+                            end=datetime(2016, 6, 7))
+        assert len(ts_window.index) == 1
+        nptest.assert_equal(ts_window.index.values, ts.index.values[1:2])
+        nptest.assert_equal(ts_window['sm'].values, ts['sm'].values[1:2])
+        nptest.assert_equal(ts_window['flag'].values, ts['flag'].values[1:2])
+
+        lon, lat = ds.grid.gpi2lonlat(914400)
+        ts_start = ds.read(lon, lat, start=datetime(2016, 6, 7, 12))
+        nptest.assert_equal(ts_start['sm'].values, ts['sm'].values[2:])
+
+        assert ds.read(914400, end=datetime(2000, 1, 1)).empty
+
+        # raw time values as index
+        ts_raw = ds.read(914400, dates_direct=True)
+        assert ts_raw.index.dtype.kind == 'f'
+        nptest.assert_equal(ts_raw['sm'].values, ts['sm'].values)
+        nptest.assert_equal(ds.read(914400).index.values, ts.index.values)
+
+        # only the dates in both start/end and period are read
+        ts_both = ds.read(914400, start=datetime(2016, 6, 7),
+                          period=(datetime(2016, 6, 1), datetime(2016, 6, 7)))
+        nptest.assert_equal(ts_both.index.values, ts.index.values[1:2])
+        with pytest.raises(ValueError):
+            ds.read(914400, end=datetime(2016, 6, 6),
+                    period=(datetime(2016, 6, 7), datetime(2016, 6, 8)))
+
+
+def test_CCITs_open_file_cache(ts_path):
+    """
+    test keeping several cell files open
+    """
+    gpi_31 = 914400
+    ds = CCITs(ts_path)
+    gpi_67 = ds.grid.activegpis[ds.grid.activearrcell == 67][0]
+    ts = [ds.read(gpi_67), ds.read(gpi_31)]
+
+    ds = CCITs(ts_path, max_open_files=2)
+    for _ in range(3):
+        nptest.assert_equal(ds.read(gpi_67)['sm'].values, ts[0]['sm'].values)
+        nptest.assert_equal(ds.read(gpi_31)['sm'].values, ts[1]['sm'].values)
+    assert ds.cache_stats() == {'open': 2, 'hits': 4, 'misses': 2,
+                                'evictions': 0, 'cached_bytes': 0}
+
+    # only one file is kept open by default
+    ds = CCITs(ts_path)
+    for _ in range(3):
+        ds.read(gpi_67)
+        ds.read(gpi_31)
+    assert ds.cache_stats()['misses'] == 6
+    assert ds.cache_stats()['evictions'] == 5
+
+    # the bulk data of the other file is dropped when the limit is exceeded
+    ds = CCITs(ts_path, max_open_files=2, max_cached_bytes=1,
+               ioclass_kws={'read_bulk': True})
+    ds.read(gpi_67)
+    assert ds.cache_stats()['cached_bytes'] > 0
+    nptest.assert_equal(ds.read(gpi_31)['sm'].values, ts[1]['sm'].values)
+    assert ds.cache_stats()['open'] == 1
+    assert ds.evictions == 1
+    ds.close()
+    assert ds.cache_stats()['open'] == 0
+
+
+def test_CCITs_map_cells(ts_path, tmp_path):
+    """
+    test applying a function to the time series of all cells
+    """
+    ds = CCITs(ts_path)
+    results, gpis = ds.map_cells(_sm_stats, parameters=['sm'])
+    assert gpis.size == ds.grid.activegpis.size == 334
+    assert np.all(np.diff(ds.grid.gpi2cell(gpis)) >= 0)
+    for i in [0, 100, 333]:
+        ts = ds.read(gpis[i])
+        nptest.assert_almost_equal(results['sm_mean'][i],
+                                   np.nanmean(ts['sm'].values))
+        assert results['n_obs'][i] == np.sum(np.isfinite(ts['sm'].values))
+
+    outfile = str(tmp_path / 'stats.nc')
+    results_par, gpis_par = ds.map_cells(_sm_stats, workers=2, cells=[67],
+                                         parameters=['sm'], outfile=outfile)
+    in_cell = ds.grid.gpi2cell(gpis) == 67
+    nptest.assert_equal(gpis_par, gpis[in_cell])
+    nptest.assert_equal(results_par['sm_mean'], results['sm_mean'][in_cell])
+    with Dataset(outfile) as nc:
+        nptest.assert_equal(nc.variables['gpi'][:], gpis_par)
+        nptest.assert_equal(nc.variables['n_obs'][:], results_par['n_obs'])
+
+
+def test_CCITs_quality_filter(ts_path):
+    """
+    test masking soil moisture by the flag while reading
+    """
+    ds = CCITs(ts_path)
+    gpis = ds.grid.activegpis[:50]
+    data, _, dates = ds.read_many(gpis, parameters=['sm', 'flag'])
+    good = (data['flag'] & ~1) == 0
+    assert 0 < good.sum() < good.size
+
+    data_qc, _, dates_qc = ds.read_many(gpis, parameters='sm',
+                                        flags_allowed=1)
+    assert list(data_qc.keys()) == ['sm']
+    nptest.assert_equal(dates_qc, dates)
+    nptest.assert_equal(data_qc['sm'], np.where(good, data['sm'], np.nan))
+
+    valid = good & np.isfinite(data['sm'])
+    for i in [0, 10]:
+        ts = ds.read(gpis[i], flags_allowed=1)
+        nptest.assert_equal(ts['sm'].values, data_qc['sm'][i])
+        ts = ds.read(gpis[i], flags_allowed=1, drop_masked=True)
+        nptest.assert_equal(ts.index.values, dates[valid[i]])
+        nptest.assert_equal(ts['sm'].values, data['sm'][i][valid[i]])
+
+    data_qc, _, dates_qc = ds.read_many(gpis[:1], parameters='flag',
+                                        flags_allowed=1, drop_masked=True)
+    nptest.assert_equal(dates_qc, dates[valid[0]])
+    nptest.assert_equal(data_qc['flag'][0], data['flag'][0][valid[0]])
+
+    # the period is also applied to filtered reads
+    period = (datetime(2016, 6, 7), datetime(2016, 6, 7))
+    ts = ds.read(gpis[0], period=period, flags_allowed=255)
+    nptest.assert_equal(ts.index.values, dates[1:2])
+    nptest.assert_equal(ts['sm'].values, data['sm'][0][1:2])
+    ts = ds.read(gpis[0], period=period, max_uncertainty=1e9)
+    assert len(ts.index) == 1
+    with pytest.raises(ValueError):
+        ds.read(gpis[0], flags_allowed=1, dates_direct=True)